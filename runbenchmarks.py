@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Benchmarks of django-unaccent, run on a test database created (and destroyed) like the tests' one.
+
+Two kinds of measures are made:
+
+* micro benchmarks of the ORM side cost (adding filters through patched_wherenode_add, rendering the SQL
+  of UnaccentNode, asciify) compared to plain Django lookups,
+* end to end timings of every operator on seeded tables, without and with the unaccent_indexes indexes
+  (PostgreSQL only).
+
+Results are saved as JSON and can be compared to a previous run::
+
+    $ python runbenchmarks.py -o before.json
+    $ python runbenchmarks.py -o after.json --compare before.json --threshold 1.2
+"""
+
+import datetime
+import json
+import platform
+import sys, os
+import timeit
+from optparse import OptionParser, make_option
+
+from django.conf import settings
+
+from runtests import get_db_connection_info, get_db_option_list, get_minimal_django_settings
+
+
+# Seeded usernames are built from these names, suffixed by the row number to make them unique
+SEED_NAMES = [u"Ôtâèkù", u"Otaeku", u"Élodie", u"Jérôme", u"Françoise", u"Søren", u"Łukasz", u"Zoë", u"Müller",
+              u"Nuñez", u"Smith", u"Dupont"]
+
+# Search term of each operator family (smart operators are given the accented one, to measure their fallback)
+SEARCH_TERMS = {
+    'unaccent': (u"Otaeku1", u"Ôtâèkù1"),
+    'contains_unaccent': (u"aek", u"âèk"),
+    'startswith_unaccent': (u"Otae", u"Ôtâè"),
+    'endswith_unaccent': (u"eku1", u"èkù1"),
+    'in_unaccent': ([u"Otaeku1", u"Elodie2", u"Jerome3"], [u"Ôtâèkù1", u"Élodie2", u"Jérôme3"]),
+}
+
+
+def best_of(func, number, repeat):
+    """Returns the best time of a call to func, in seconds"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def search_term(lookup_type):
+    """Returns the search term of a lookup_type, None if it is not benchmarked"""
+    from django_unaccent.unaccent import UnaccentOperation
+
+    lookup = UnaccentOperation.lookups[lookup_type]
+    family = lookup.lookup_type[1:] if lookup.case_insensitive else lookup.lookup_type
+    if family not in SEARCH_TERMS:
+        return None
+    ascii_term, accented_term = SEARCH_TERMS[family]
+    return accented_term if lookup.smart else ascii_term
+
+
+def find_unaccent_node(where):
+    from django_unaccent.unaccent import UnaccentNode
+
+    for child in where.children:
+        if isinstance(child, UnaccentNode):
+            return child
+        if hasattr(child, 'children'):
+            node = find_unaccent_node(child)
+            if node is not None:
+                return node
+    return None
+
+
+def run_micro_benchmarks(number, repeat):
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django_unaccent.evaluator import unaccent_filter
+    from django_unaccent.unaccent import asciify, asciify_many, UnaccentOperation
+
+    rows = [{'username': name} for name in SEED_NAMES * 10]
+
+    def sql(queryset):
+        return lambda: queryset.query.get_compiler(queryset.db).as_sql()
+
+    results = {
+        'filter_icontains': best_of(lambda: User.objects.filter(username__icontains=u"aek"), number, repeat),
+        'filter_icontains_unaccent': best_of(lambda: User.objects.filter(username__icontains_unaccent=u"aek"),
+                                             number, repeat),
+        'filter_icontains_unaccent_smart': best_of(
+            lambda: User.objects.filter(username__icontains_unaccent_smart=u"âèk"), number, repeat),
+        'as_sql_icontains': best_of(sql(User.objects.filter(username__icontains=u"aek")), number, repeat),
+        'as_sql_icontains_unaccent': best_of(sql(User.objects.filter(username__icontains_unaccent=u"aek")),
+                                             number, repeat),
+        'clone_icontains': best_of(User.objects.filter(username__icontains=u"aek")._clone, number, repeat),
+        'clone_icontains_unaccent': best_of(User.objects.filter(username__icontains_unaccent=u"aek")._clone,
+                                            number, repeat),
+        'asciify_many': best_of(lambda: list(asciify_many(SEED_NAMES * 10)), number, repeat) / (len(SEED_NAMES) * 10),
+        'accept_smart_ascii': best_of(lambda: UnaccentOperation.accept('icontains_unaccent_smart', u"aek"),
+                                      number, repeat),
+        'accept_smart_accented': best_of(lambda: UnaccentOperation.accept('icontains_unaccent_smart', u"âèk"),
+                                         number, repeat),
+        'asciify': best_of(lambda: [asciify(name) for name in SEED_NAMES], number, repeat) / len(SEED_NAMES),
+        'unaccent_filter': best_of(lambda: unaccent_filter(rows, username__icontains_unaccent=u"aek"),
+                                   number, repeat) / len(rows),
+    }
+
+    node = find_unaccent_node(User.objects.filter(username__icontains_unaccent=u"aek").query.where)
+    compiler = User.objects.all().query.get_compiler(connection=connection)
+    results['unaccent_node_as_sql'] = best_of(lambda: node.as_sql(compiler.quote_name_unless_alias, connection),
+                                              number, repeat)
+    return results
+
+
+def seed(rows):
+    """Replaces the content of auth_user with `rows' users"""
+    from django.contrib.auth.models import User
+    from django.db import connection, transaction
+
+    cursor = connection.cursor()
+    User.objects.all().delete()
+
+    if connection.vendor == 'postgresql':
+        cursor.execute("""
+            INSERT INTO auth_user (username, first_name, last_name, email, password,
+                                   is_staff, is_active, is_superuser, last_login, date_joined)
+            SELECT (%s::text[])[1 + i %% %s] || i, '', '', '', '', false, true, false, now(), now()
+            FROM generate_series(1, %s) AS i
+        """, [SEED_NAMES, len(SEED_NAMES), rows])
+        cursor.execute('ANALYZE auth_user')
+    else:
+        now = datetime.datetime.now()
+        batch_size = 10000
+        for start in xrange(1, rows + 1, batch_size):
+            User.objects.bulk_create([
+                User(username=u"%s%d" % (SEED_NAMES[i % len(SEED_NAMES)], i), last_login=now, date_joined=now)
+                for i in xrange(start, min(start + batch_size, rows + 1))
+            ])
+    transaction.commit_unless_managed()
+
+
+def run_query_benchmarks(repeat):
+    from django.contrib.auth.models import User
+    from django_unaccent.unaccent import UnaccentOperation
+
+    results = {}
+    for lookup_type in sorted(UnaccentOperation.lookups):
+        term = search_term(lookup_type)
+        if term is not None:
+            queryset = User.objects.filter(**{'username__' + lookup_type: term})
+            results[lookup_type] = best_of(queryset.count, 1, repeat)
+    return results
+
+
+def create_indexes():
+    """Creates the unaccent expression indexes, returns False if the database does not support them"""
+    from django.core.management import call_command
+    from django.db import connection
+
+    if connection.vendor != 'postgresql':
+        return False
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    call_command('unaccent_indexes', 'auth.User.username', trigram=bool(cursor.fetchone()))
+    cursor.execute('ANALYZE auth_user')
+    return True
+
+
+def run_benchmarks(options):
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from django.utils.importlib import import_module
+    from django_unaccent.unaccent import monkey_patch_where_node, UnaccentOperation
+
+    monkey_patch_where_node()
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+
+    results = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'django': import_module('django').get_version(),
+            'vendor': connection.vendor,
+        },
+        'micro': {},
+        'queries': {},
+    }
+
+    try:
+        results['micro'] = run_micro_benchmarks(options.number, options.repeat)
+
+        # The function is created up front so that both runs only differ by the indexes
+        if connection.vendor == 'postgresql':
+            from django_unaccent.indexes import immutable_function_sql
+            connection.cursor().execute(immutable_function_sql(connection=connection))
+        settings.UNACCENT_FUNCTION = UnaccentOperation.immutable_function
+        UnaccentOperation.clear_sql_cache()
+
+        for rows in options.rows:
+            seed(rows)
+            timings = results['queries'][str(rows)] = {'no_index': run_query_benchmarks(options.repeat)}
+            if create_indexes():
+                timings['index'] = run_query_benchmarks(options.repeat)
+                call_command('unaccent_indexes', 'auth.User.username', drop=True, trigram=True)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    return results
+
+
+def flatten(results, prefix=''):
+    """Returns {'queries.10000.index.iunaccent': 0.001, ...} from nested results, meta excluded"""
+    flat = {}
+    for key, value in results.items():
+        if key == 'meta':
+            continue
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, previous, threshold):
+    """Prints the timings slower than `threshold' times their previous value, returns their number"""
+    current, previous = flatten(results), flatten(previous)
+    regressions = 0
+    for name in sorted(set(current) & set(previous)):
+        ratio = current[name] / previous[name] if previous[name] else 1
+        if ratio > threshold:
+            regressions += 1
+            sys.stdout.write('REGRESSION %s: %.6fs -> %.6fs (x%.2f)\n' % (name, previous[name], current[name], ratio))
+    return regressions
+
+
+if __name__ == '__main__':
+    opt_list = get_db_option_list() + [
+            # Benchmark settings
+            make_option('-o', '--output', default='benchmarks.json', help='JSON file the results are written to'),
+            make_option('-r', '--rows', default='10000',
+                help='Comma separated sizes of the seeded table, eg: 10000,1000000,10000000'),
+            make_option('-n', '--number', type='int', default=1000,
+                help='Number of calls of each micro benchmark'),
+            make_option('--repeat', type='int', default=3, help='Each timing is the best of this number of runs'),
+            make_option('--compare', default=None, help='JSON results of a previous run to compare to'),
+            make_option('--threshold', type='float', default=1.2,
+                help='Ratio to the previous timing above which a regression is reported'),
+    ]
+
+    parser = OptionParser(option_list=opt_list)
+    options, _ = parser.parse_args()
+    options.rows = [int(rows) for rows in options.rows.split(',')]
+
+    settings.configure(**get_minimal_django_settings(get_db_connection_info(options)))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+    results = run_benchmarks(options)
+    with open(options.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as previous:
+            sys.exit(1 if compare(results, json.load(previous), options.threshold) else 0)
@@ -9,9 +9,10 @@ from django.conf import settings
 
 # the table need to have the unaccent sql function available
 # The user must have the right to create a table
-DbConnectionInfo = namedtuple('DbConnectionInfo', ['name', 'user', 'password', 'host'])
+DbConnectionInfo = namedtuple('DbConnectionInfo', ['engine', 'name', 'user', 'password', 'host'])
 
 default_db_connection_info = DbConnectionInfo(
+  engine='postgresql_psycopg2',
   name='django_unaccent_db',
   user='django_unaccent_user',
   password='',
@@ -23,10 +24,11 @@ def get_minimal_django_settings(db_info=default_db_connection_info):
         INSTALLED_APPS=[
             'django.contrib.auth',
             'django.contrib.contenttypes',
+            'django_unaccent',
         ],
         DATABASES={
             'default': {
-                'ENGINE': 'django.db.backends.postgresql_psycopg2',
+                'ENGINE': 'django.db.backends.' + db_info.engine,
                 'NAME': db_info.name,
                 'USER': db_info.user,
                 'PASSWORD': db_info.password,
@@ -49,11 +51,11 @@ def set_settings_and_runtests(db_connection_info, verbosity=1, interactive=False
 
 
 
-if __name__ == '__main__':
-    opt_db_info = default_db_connection_info
-
-    opt_list = [
+def get_db_option_list(opt_db_info=default_db_connection_info):
+    return [
             # Database settings
+            make_option('-e', '--engine', default=opt_db_info.engine, choices=['postgresql_psycopg2', 'sqlite3'],
+                help='The database backend, sqlite3 uses the Python unaccent engine and needs no database server'),
             make_option('-d', '--database', default=opt_db_info.name,
                 help='The database to use for testing django-unaccent. Must have the unaccent SQL function available'),
             make_option('-u', '--user', default=opt_db_info.user,
@@ -61,6 +63,15 @@ if __name__ == '__main__':
             make_option('-p', '--password', default=opt_db_info.password,
                 help='password, if any, to connect to the database'),
             make_option('-H', '--host', default=opt_db_info.host, help=''),
+    ]
+
+
+def get_db_connection_info(options):
+    return DbConnectionInfo(options.engine, options.database, options.user, options.password, options.host)
+
+
+if __name__ == '__main__':
+    opt_list = get_db_option_list() + [
             # Add test settings ?
             # parser.add_option('--failfast', action='store_true', default=False, dest='failfast')
     ]
@@ -69,8 +80,6 @@ if __name__ == '__main__':
 
     options, _ = parser.parse_args()
 
-    db_info = DbConnectionInfo(options.database, options.user, options.password, options.host)
+    db_info = get_db_connection_info(options)
 
     set_settings_and_runtests(db_info)
-
-
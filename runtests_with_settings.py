@@ -25,7 +25,7 @@ class UnaccentDjangoTestSuiteRunner(DjangoTestSuiteRunner):
 
     def build_suite(self, test_labels=None, extra_tests=None, **kwargs):
         # Make django-unaccent searchable
-        unaccent_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'django_unaccent')
+        unaccent_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
         sys.path.insert(0, unaccent_dir)
 
         suite = unittest.TestSuite()
@@ -17,7 +17,8 @@ setup(
         keywords = "django postgres postgresql orm unaccent",
         # url = "",
         package_dir = {'': 'src'},
-        packages = ['django_unaccent'],
+        packages = ['django_unaccent', 'django_unaccent.management', 'django_unaccent.management.commands'],
+        package_data = {'django_unaccent': ['unaccent.rules']},
         long_description=read('README.rst'),
         install_requires = [
             'django<1.5',
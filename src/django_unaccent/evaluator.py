@@ -0,0 +1,151 @@
+# coding: utf-8
+"""Evaluation of the unaccent lookups in Python, eg: on objects already fetched by prefetch_related.
+
+    user = User.objects.prefetch_related('groups').get(pk=1)
+    unaccent_filter(user.groups.all(), name__iunaccent=u'equipe')  # no query
+
+The lookups have the semantics of the SQL path: the values and the search terms are normalized with the rules
+of the database (see rules.get_rules_file), the smart operators fall back to the plain Django lookups
+(see UnaccentOperation.non_unaccent_filter_fallback) when the search term has accents, and these plain lookups
+can be used too. As in the database, None values match nothing.
+
+The full text lookups (search_unaccent) can not be evaluated in Python. Note that, unlike PostgreSQL, SQLite
+only folds the case of ascii characters and its LIKE (contains, startswith...) is case insensitive, see README.
+"""
+
+import operator
+
+from django.db.models.sql.constants import QUERY_TERMS
+
+from . import rules
+from .unaccent import has_accents, UnaccentOperation
+
+# Plain Django lookup_type -> the unaccent lookup_type falling back to it, see get_lookup
+fallback_lookups = dict((fallback, lookup_type)
+                        for lookup_type, fallback in UnaccentOperation.non_unaccent_filter_fallback.iteritems())
+
+
+def get_lookup(lookup_type):
+    """Returns the UnaccentLookup of lookup_type, or of the lookup_type falling back to it for plain lookups"""
+    lookup = UnaccentOperation.lookups.get(lookup_type)
+    if lookup is None and lookup_type in fallback_lookups:
+        lookup = UnaccentOperation.lookups[fallback_lookups[lookup_type]]
+    if lookup is None or lookup.text_search:
+        raise ValueError("%r can not be evaluated in Python" % lookup_type)
+    return lookup
+
+
+def get_comparator(lookup):
+    """Returns the function(normalized value, normalized term) comparing as the SQL operator of the lookup"""
+    if lookup.multiple:
+        return lambda value, terms: value in terms
+    pattern = lookup.like_pattern
+    if pattern is None:
+        return operator.eq
+    if pattern.startswith(u'%') and pattern.endswith(u'%'):
+        return lambda value, term: term in value
+    if pattern.startswith(u'%'):
+        return lambda value, term: value.endswith(term)
+    return lambda value, term: value.startswith(term)
+
+
+def compile_normalizer(unaccent, upper):
+    """Returns the function normalizing a value as the database does, the translation table is bound once"""
+    if unaccent:
+        translate = rules.get_translation_table().translate
+        if upper:
+            return lambda value: translate(value).upper()
+        return translate
+    if upper:
+        return lambda value: value.upper()
+    return lambda value: value
+
+
+def compile_lookup(lookup_type, term, cache_size=10000):
+    """Returns a function(value) telling whether a value matches field__lookup_type=term, as the SQL path does.
+
+    The results are memoized (up to cache_size distinct values) as the values of a column usually repeat.
+    As QuerySet.filter, a None term matches the None values of an exact lookup, and is rejected by the others.
+    """
+    if term is None:
+        if lookup_type != 'exact':
+            raise ValueError("Cannot use None as a query value")
+        return lambda value: value is None
+
+    lookup = get_lookup(lookup_type)
+    compare = get_comparator(lookup)
+    normalize = compile_normalizer(lookup_type in UnaccentOperation.lookups, lookup.case_insensitive)
+
+    if lookup.multiple:
+        terms, accented_terms = set(), set()
+        for value in term:
+            if value is None:
+                continue
+            if lookup.smart and has_accents(value):
+                # As UnaccentNode.multiple_as_sql, the accented terms are compared to the values themselves
+                accented_terms.add(value.upper() if lookup.case_insensitive else value)
+            else:
+                terms.add(normalize(unicode(value)))
+        raw = compile_normalizer(False, lookup.case_insensitive)
+
+        def match(value):
+            return compare(normalize(value), terms) or compare(raw(value), accented_terms)
+    else:
+        if lookup.smart and lookup_type in UnaccentOperation.lookups and has_accents(term):
+            # As UnaccentOperation.accept, fall back to the plain Django lookup
+            normalize = compile_normalizer(False, lookup.case_insensitive)
+        term = normalize(unicode(term))
+
+        def match(value):
+            return compare(normalize(value), term)
+
+    memo = {None: False}
+
+    def matches(value):
+        try:
+            return memo[value]
+        except KeyError:
+            if len(memo) >= cache_size:
+                memo.clear()
+                memo[None] = False
+            memo[value] = result = match(value if isinstance(value, unicode) else unicode(value))
+            return result
+    return matches
+
+
+def get_value(obj, path):
+    """Returns the value of a '__' separated path of attributes (model instances) or keys (dicts), None if
+    a step is None.
+    """
+    for name in path:
+        if obj is None:
+            return None
+        obj = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+    return obj
+
+
+def compile_filter(**lookups):
+    """Returns a function(obj) telling whether a model instance or a dict matches all the lookups,
+    eg: compile_filter(name__icontains_unaccent=u'sao', country__code__iexact=u'br')
+
+    As in QuerySet.filter, a key not ending with a lookup_type is an exact lookup, eg: country__code=u'BR'.
+    """
+    predicates = []
+    for key, term in lookups.iteritems():
+        path, _, lookup_type = key.rpartition('__')
+        if not path or (lookup_type not in UnaccentOperation.lookups and lookup_type not in QUERY_TERMS):
+            path, lookup_type = key, 'exact'
+        predicates.append((path.split('__'), compile_lookup(lookup_type, term)))
+
+    def matches(obj):
+        for path, predicate in predicates:
+            if not predicate(get_value(obj, path)):
+                return False
+        return True
+    return matches
+
+
+def unaccent_filter(objects, **lookups):
+    """Returns the list of the model instances or dicts of `objects' matching all the lookups, see compile_filter"""
+    matches = compile_filter(**lookups)
+    return [obj for obj in objects if matches(obj)]
@@ -0,0 +1,221 @@
+# coding: utf-8
+"""SQL helpers making the unaccent lookups index friendly on PostgreSQL.
+
+PostgreSQL's unaccent() is only STABLE (its result depends on the dictionary it loads), so it cannot be used
+in an index expression. We wrap it in an IMMUTABLE function and build expression indexes on the very
+expression rendered by UnaccentNode.as_sql, so that the planner can match them.
+
+These helpers return plain SQL statements: they are used by the unaccent_indexes management command
+and can be executed as is from a migration (eg: South's db.execute).
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection as default_connection
+from django.db.backends.util import truncate_name
+from django.db.models import get_model
+from django.db.models.fields import FieldDoesNotExist
+
+from .unaccent import UnaccentConcatNode, UnaccentOperation
+
+
+# (index name suffix, lookup_type whose column expression is indexed, index method, operator class)
+# The text_pattern_ops variants serve the LIKE 'term%' queries of the startswith_unaccent family
+# when the database does not use the C locale.
+INDEX_VARIANTS = (
+    ('unaccent', 'unaccent', 'btree', None),
+    ('iunaccent', 'iunaccent', 'btree', None),
+    ('unaccent_like', 'startswith_unaccent', 'btree', 'text_pattern_ops'),
+    ('iunaccent_like', 'istartswith_unaccent', 'btree', 'text_pattern_ops'),
+)
+
+# Btree indexes can not serve LIKE '%term%' nor LIKE '%term': the pg_trgm GIN indexes serve the contains_unaccent
+# and endswith_unaccent families (and any LIKE on the same expression).
+TRIGRAM_INDEX_VARIANTS = (
+    ('unaccent_trgm', 'contains_unaccent', 'gin', 'gin_trgm_ops'),
+    ('iunaccent_trgm', 'icontains_unaccent', 'gin', 'gin_trgm_ops'),
+)
+
+# The primary key follows the expression in these indexes, they serve the ordering of keyset.keyset_iterator
+KEYSET_INDEX_VARIANTS = (
+    ('unaccent_keyset', 'unaccent', 'btree', None),
+    ('iunaccent_keyset', 'iunaccent', 'btree', None),
+)
+
+
+def get_field(label):
+    """Returns the (model, field) couple matching a 'app_label.Model.field' label.
+
+    The fields of a concatenation (see concat_index_sql) are joined by '+', eg: 'auth.User.first_name+last_name',
+    a list of fields is then returned in place of the field.
+    """
+    try:
+        app_label, model_name, field_name = label.split('.')
+    except ValueError:
+        raise ImproperlyConfigured("%r is not a valid field label, expected 'app_label.Model.field'" % label)
+
+    model = get_model(app_label, model_name)
+    if model is None:
+        raise ImproperlyConfigured("Unknown model %s.%s" % (app_label, model_name))
+    try:
+        fields = [model._meta.get_field(name) for name in field_name.split('+')]
+    except FieldDoesNotExist as e:
+        raise ImproperlyConfigured("%s on model %s.%s" % (e, app_label, model_name))
+    return model, fields if len(fields) > 1 else fields[0]
+
+
+def get_indexed_fields(labels=None):
+    """Returns the (model, field) couples of the given labels, defaults to the UNACCENT_INDEXED_FIELDS setting."""
+    if not labels:
+        labels = getattr(settings, 'UNACCENT_INDEXED_FIELDS', ())
+    return [get_field(label) for label in labels]
+
+
+def immutable_function_sql(function=UnaccentOperation.immutable_function, schema='public',
+                           connection=default_connection):
+    """Returns the SQL creating the IMMUTABLE wrapper around unaccent().
+
+    The function and its dictionary are qualified by the schema of the unaccent extension: the result of the
+    wrapper must not depend on the search_path (eg: of pg_restore, autovacuum or other sessions).
+    """
+    qn = connection.ops.quote_name
+    return ("CREATE OR REPLACE FUNCTION %(function)s(text) RETURNS text AS "
+            "$$ SELECT %(schema)s.unaccent('%(schema)s.unaccent'::regdictionary, $1) $$ "
+            "LANGUAGE sql IMMUTABLE STRICT" % {'function': function, 'schema': qn(schema)})
+
+
+def trigram_extension_sql():
+    """Returns the SQL installing pg_trgm (PostgreSQL >= 9.1), needed by the trigram indexes."""
+    return 'CREATE EXTENSION IF NOT EXISTS pg_trgm'
+
+
+def column_sql(field, connection=default_connection):
+    """Returns the unqualified column as rendered by UnaccentNode.sql_for_columns."""
+    db_type = field.db_type(connection=connection)
+    return connection.ops.field_cast_sql(db_type) % connection.ops.quote_name(field.column)
+
+
+def index_name(model, field, suffix, connection=default_connection):
+    name = '%s_%s_%s' % (model._meta.db_table, field.column, suffix)
+    return truncate_name(name, connection.ops.max_name_length())
+
+
+def index_sql(model, field, connection=default_connection, function=UnaccentOperation.immutable_function,
+              pattern_ops=True, trigram=False, keyset=False):
+    """Returns the list of (index_name, create_index_sql) for the expression indexes of a field.
+
+    Args:
+        pattern_ops: also create the text_pattern_ops indexes used by the startswith_unaccent lookups
+        trigram: also create the gin_trgm_ops indexes used by the contains_unaccent and endswith_unaccent lookups
+        keyset: also create the (expression, primary key) indexes used by keyset.keyset_iterator
+    """
+    qn = connection.ops.quote_name
+    column = column_sql(field, connection)
+
+    variants = (INDEX_VARIANTS + (TRIGRAM_INDEX_VARIANTS if trigram else ()) +
+                (KEYSET_INDEX_VARIANTS if keyset else ()))
+
+    statements = []
+    for suffix, lookup_type, method, opclass in variants:
+        if opclass == 'text_pattern_ops' and not pattern_ops:
+            continue
+        name = index_name(model, field, suffix, connection)
+        # Index expressions must be parenthesized, the operator class follows the parenthesis
+        expression = '(%s)' % (UnaccentOperation.lookup_cast(lookup_type, function) % column)
+        if opclass:
+            expression = '%s %s' % (expression, opclass)
+        if (suffix, lookup_type, method, opclass) in KEYSET_INDEX_VARIANTS:
+            expression = '%s, %s' % (expression, qn(model._meta.pk.column))
+        statements.append((name, 'CREATE INDEX %s ON %s USING %s (%s)' % (
+            qn(name), qn(model._meta.db_table), method, expression)))
+    return statements
+
+
+def concat_index_sql(model, fields, connection=default_connection, function=UnaccentOperation.immutable_function,
+                     pattern_ops=True, trigram=False):
+    """Returns the list of (index_name, create_index_sql) for the expression indexes of a concatenation of fields
+    (see unaccent.concat_filter). Only the case insensitive lookups, the usual ones for such searches, are indexed.
+
+    Args:
+        pattern_ops: also create the text_pattern_ops index used by the istartswith_unaccent lookup
+        trigram: also create the gin_trgm_ops index used by the icontains_unaccent and iendswith_unaccent lookups
+    """
+    qn = connection.ops.quote_name
+    columns = '_'.join(field.column for field in fields)
+
+    variants = INDEX_VARIANTS + (TRIGRAM_INDEX_VARIANTS if trigram else ())
+
+    statements = []
+    for suffix, lookup_type, method, opclass in variants:
+        if lookup_type not in UnaccentOperation.case_insensitive_operators:
+            continue
+        if opclass == 'text_pattern_ops' and not pattern_ops:
+            continue
+        name = truncate_name('%s_%s_%s' % (model._meta.db_table, columns, suffix), connection.ops.max_name_length())
+        node = UnaccentConcatNode(None, fields, lookup_type, None)
+        expression = '(%s)' % node.lhs_sql(qn, connection, function)
+        if opclass:
+            expression = '%s %s' % (expression, opclass)
+        statements.append((name, 'CREATE INDEX %s ON %s USING %s (%s)' % (
+            qn(name), qn(model._meta.db_table), method, expression)))
+    return statements
+
+
+def collation_sql(name, connection=default_connection):
+    """Returns the SQL creating a nondeterministic ICU collation of UnaccentOperation.collation_locales
+    (PostgreSQL >= 12, built with ICU)."""
+    return "CREATE COLLATION IF NOT EXISTS %s (provider = icu, locale = '%s', deterministic = false)" % (
+        connection.ops.quote_name(name), UnaccentOperation.collation_locales[name])
+
+
+def drop_collation_sql(name, connection=default_connection):
+    return 'DROP COLLATION IF EXISTS %s' % connection.ops.quote_name(name)
+
+
+def collation_index_sql(model, field, connection=default_connection):
+    """Returns the list of (index_name, create_index_sql) for the indexes built with the collations,
+    used by the lookups rendered with a COLLATE clause (see UnaccentOperation.get_collation)."""
+    qn = connection.ops.quote_name
+    statements = []
+    for collation in sorted(set(UnaccentOperation.collations.values())):
+        name = index_name(model, field, collation.replace('django_', '') + '_coll', connection)
+        statements.append((name, 'CREATE INDEX %s ON %s (%s COLLATE %s)' % (
+            qn(name), qn(model._meta.db_table), column_sql(field, connection), qn(collation))))
+    return statements
+
+
+def text_search_config_sql(config=None, copy='simple', dictionary=None, connection=default_connection):
+    """Returns the SQL creating, if missing, the text search configuration of the search_unaccent lookup:
+    a copy of `copy' whose words go through the unaccent dictionary (of the unaccent extension) first.
+
+    Args:
+        dictionary: the dictionary applied after unaccent, defaults to `copy'_stem (eg: french_stem)
+                    or simple for the simple configuration
+    """
+    config = config or UnaccentOperation.get_text_search_config('search_unaccent')
+    if dictionary is None:
+        dictionary = 'simple' if copy == 'simple' else '%s_stem' % copy
+    qn = connection.ops.quote_name
+    # CREATE TEXT SEARCH CONFIGURATION has no IF NOT EXISTS clause
+    return ("DO $$ BEGIN IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = '%(name)s') THEN "
+            "CREATE TEXT SEARCH CONFIGURATION %(config)s (COPY = %(copy)s); "
+            "ALTER TEXT SEARCH CONFIGURATION %(config)s ALTER MAPPING FOR hword, hword_part, word "
+            "WITH unaccent, %(dictionary)s; "
+            "END IF; END $$" % {'name': config, 'config': qn(config), 'copy': copy, 'dictionary': dictionary})
+
+
+def drop_text_search_config_sql(config=None, connection=default_connection):
+    config = config or UnaccentOperation.get_text_search_config('search_unaccent')
+    return 'DROP TEXT SEARCH CONFIGURATION IF EXISTS %s' % connection.ops.quote_name(config)
+
+
+def text_search_index_sql(model, field, connection=default_connection):
+    """Returns the (index_name, create_index_sql) of the GIN index of the search_unaccent lookup"""
+    qn = connection.ops.quote_name
+    name = index_name(model, field, 'unaccent_tsv', connection)
+    expression = UnaccentOperation.lookup_cast('search_unaccent') % column_sql(field, connection)
+    return name, 'CREATE INDEX %s ON %s USING gin ((%s))' % (qn(name), qn(model._meta.db_table), expression)
+
+
+def drop_index_sql(name, connection=default_connection):
+    return 'DROP INDEX IF EXISTS %s' % connection.ops.quote_name(name)
@@ -0,0 +1,72 @@
+# coding: utf-8
+"""Streaming of large unaccent search results, in chunks fetched by keyset pagination, eg: for exports.
+
+    for user in keyset_iterator(User.objects.all(), 'username', 'icontains_unaccent', u'jérôme', chunk_size=1000):
+        ...
+
+Each chunk is a short query of its own, ordered by the normalized column the lookup compares (the expression
+of the expression indexes, the shadow column or the column with its collation, see UnaccentNode.lhs_sql) then
+by primary key, and starting right after the last row of the previous chunk:
+
+    WHERE ... AND (UPPER(f_unaccent("username"::text)), "id") > ('JEROME A', 1234) ORDER BY 1, 2 LIMIT 1000
+
+Unlike OFFSET pagination, every chunk costs the same, and unlike QuerySet.iterator() no query stays open
+between chunks: only a chunk of instances is held in memory. The btree expression indexes of the unaccent_indexes
+command serve the ordering, create them with --keyset to also include the primary key.
+
+The normalized value of each instance is set as its `unaccent_key' attribute. Rows changed during the iteration
+may be missed or returned twice if their normalized value moves across the position of the iteration.
+"""
+
+from django.db import connections
+
+from .unaccent import UnaccentNode, UnaccentOperation
+
+
+def key_sql(queryset, field, lookup_type):
+    """Returns the SQL of the (normalized column, primary key) couple the results of the lookup are ordered by"""
+    connection = connections[queryset.db]
+    qn = connection.ops.quote_name
+    lookup = UnaccentOperation.lookups[lookup_type]
+    # The smart lookup_types are ordered as their unaccent counterpart
+    node = UnaccentNode(field.model._meta.db_table, field.column, field, lookup.lookup_type, None)
+    opts = queryset.model._meta
+    return node.lhs_sql(qn, connection), '%s.%s' % (qn(opts.db_table), qn(opts.pk.column))
+
+
+def keyset_iterator(queryset, field_name, lookup_type, term, chunk_size=1000):
+    """Yields the model instances of `queryset' matching field_name__lookup_type=term, in chunks of chunk_size
+    rows fetched by keyset pagination on the (normalized column, primary key) couple.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive")
+    lookup = UnaccentOperation.lookups.get(lookup_type)
+    if lookup is None or lookup.text_search:
+        raise ValueError("The results of %r can not be ordered by a normalized column" % lookup_type)
+
+    field = queryset.model._meta.get_field(field_name)
+    queryset = queryset.filter(**{'%s__%s' % (field_name, lookup_type): term})
+    key, pk = key_sql(queryset, field, lookup_type)
+    queryset = queryset.extra(select={'unaccent_key': key}).order_by('unaccent_key', 'pk')
+
+    row_values = connections[queryset.db].vendor == 'postgresql'
+    if row_values:
+        # A row comparison is served by an index on (key, pk) as a single range
+        after = '(%s, %s) > (%%s, %%s)' % (key, pk)
+    else:
+        after = '(%s > %%s OR (%s = %%s AND %s > %%s))' % (key, key, pk)
+
+    chunk = queryset
+    while True:
+        rows = list(chunk[:chunk_size])
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+
+        last = rows[-1]
+        if row_values:
+            params = [last.unaccent_key, last.pk]
+        else:
+            params = [last.unaccent_key, last.unaccent_key, last.pk]
+        chunk = queryset.extra(where=[after], params=params)
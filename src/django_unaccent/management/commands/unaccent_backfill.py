@@ -0,0 +1,46 @@
+# coding: utf-8
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import get_model
+
+from django_unaccent.shadow import backfill_shadow_fields, get_shadow_fields
+from django_unaccent.unaccent import UnaccentOperation
+
+
+class Command(BaseCommand):
+    args = '[app_label.Model ...]'
+    help = ("Fills in the unaccent shadow columns of the given models (defaults to every model having one), "
+            "committing every batch of rows.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to backfill. Defaults to the "default" database.'),
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=1000,
+            help='Number of rows updated per transaction.'),
+    )
+
+    def handle(self, *labels, **options):
+        if labels:
+            models = []
+            for label in labels:
+                try:
+                    app_label, model_name = label.split('.')
+                except ValueError:
+                    raise CommandError("%r is not a valid model label, expected 'app_label.Model'" % label)
+                model = get_model(app_label, model_name)
+                if model is None:
+                    raise CommandError("Unknown model %s" % label)
+                if not get_shadow_fields(model):
+                    raise CommandError("%s has no unaccent shadow field" % label)
+                models.append(model)
+        else:
+            models = sorted(set(model for model, source, upper in UnaccentOperation.shadow_fields),
+                            key=lambda model: model._meta.db_table)
+
+        for model in models:
+            queryset = model._default_manager.using(options['database'])
+            count = backfill_shadow_fields(model, queryset, batch_size=options['batch_size'])
+            if int(options['verbosity']) > 0:
+                self.stdout.write("%s.%s: %d rows updated\n" % (model._meta.app_label, model._meta.object_name, count))
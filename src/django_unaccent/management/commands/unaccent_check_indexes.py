@@ -0,0 +1,151 @@
+# coding: utf-8
+import json
+import re
+from optparse import make_option
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DatabaseError, DEFAULT_DB_ALIAS
+
+from django_unaccent import indexes
+from django_unaccent.unaccent import concat_filter, UnaccentOperation
+
+
+def postgresql_unindexed_scans(cursor, sql, params, columns):
+    """Returns the (scan, estimated rows) of the plan of a query which read the whole table.
+
+    Unless an Index Cond or a Recheck Cond uses the columns of the lookup, the lookup is applied as a Filter:
+    every scan is then reported, be it a sequential scan or a full scan of an unrelated index (eg: the primary
+    key, to follow an ordering).
+    """
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    columns_re = re.compile(r'\b(%s)\b' % '|'.join(re.escape(column) for column in columns))
+
+    scans, indexed, nodes = [], False, [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        for condition in ('Index Cond', 'Recheck Cond'):
+            if columns_re.search(node.get(condition, '')):
+                indexed = True
+        if 'Relation Name' in node:
+            scan = node['Node Type']
+            if 'Index Name' in node:
+                scan += ' using %s' % node['Index Name']
+            scans.append(('%s on %s' % (scan, node['Relation Name']), node['Node Type'], node['Plan Rows']))
+        nodes.extend(node.get('Plans', ()))
+    return [(scan, rows) for scan, node_type, rows in scans if not indexed or node_type == 'Seq Scan']
+
+
+def sqlite_unindexed_scans(cursor, sql, params, columns):
+    """Returns the (detail, None) of the full scans of the plan of a query, SQLite does not estimate rows"""
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    # eg: 'SCAN TABLE auth_user' or 'SCAN TABLE auth_user USING INDEX ...' (a full scan of the index) as opposed
+    # to 'SEARCH TABLE auth_user USING INDEX ...', the detail is the last column
+    return [(row[-1], None) for row in cursor.fetchall() if row[-1].startswith('SCAN')]
+
+
+class Command(BaseCommand):
+    args = '[app_label.Model.field[+field...] ...]'
+    help = ("Explains the query of every unaccent lookup on the given fields (defaults to the "
+            "UNACCENT_INDEXED_FIELDS setting) and reports those which scan the whole table, or a whole unrelated "
+            "index. "
+            "Exits with an error if any does.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates the database to check. Defaults to the "default" database.'),
+        make_option('-l', '--lookup', action='append', dest='lookups', default=None,
+            help='Lookup type to check, may be repeated. Defaults to every operator of UnaccentOperation.'),
+        make_option('--term', action='store', dest='term', default=u'unaccent',
+            help='Search term of the explained queries. Defaults to "unaccent".'),
+        make_option('--planner-costs', action='store_true', dest='planner_costs', default=False,
+            help='Report the full scans the planner picks given the current statistics. By default '
+                 'sequential scans are disabled (PostgreSQL), so that only the lookups no index can serve '
+                 'are reported.'),
+    )
+
+    def handle(self, *labels, **options):
+        using = options['database']
+        connection = connections[using]
+        verbosity = int(options.get('verbosity', 1))
+
+        if connection.vendor == 'postgresql':
+            unindexed_scans = postgresql_unindexed_scans
+        elif connection.vendor == 'sqlite':
+            unindexed_scans = sqlite_unindexed_scans
+        else:
+            raise CommandError('Checking the indexes is not supported on %s' % connection.vendor)
+
+        try:
+            fields = indexes.get_indexed_fields(labels)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        lookup_types = options['lookups'] or sorted(
+            lookup_type for lookup_type in UnaccentOperation.operators
+            # Full text search is only available on PostgreSQL
+            if connection.vendor == 'postgresql' or not UnaccentOperation.lookups[lookup_type].text_search)
+        unknown = [lookup_type for lookup_type in lookup_types if lookup_type not in UnaccentOperation.lookups]
+        if unknown:
+            raise CommandError('Unknown lookups: %s' % ', '.join(unknown))
+
+        failures = 0
+        for model, field in fields:
+            for lookup_type in lookup_types:
+                queryset = self.get_queryset(model, field, lookup_type, options['term'], using)
+                if queryset is None:
+                    continue
+                label = '%s.%s.%s__%s' % (model._meta.app_label, model._meta.object_name, self.field_name(field),
+                                          lookup_type)
+
+                cursor = connection.cursor()
+                try:
+                    if connection.vendor == 'postgresql' and not options['planner_costs']:
+                        cursor.execute('SET LOCAL enable_seqscan = off')
+                    sql, params = queryset.query.get_compiler(using=using).as_sql()
+                    scans = unindexed_scans(cursor, sql, params, self.columns(field, lookup_type))
+                except DatabaseError as e:
+                    failures += 1
+                    self.stdout.write('ERROR %s: %s\n' % (label, str(e).strip()))
+                    continue
+                finally:
+                    transaction.rollback_unless_managed(using=using)
+
+                if scans:
+                    failures += 1
+                    for scan, rows in scans:
+                        estimate = ' (estimated rows: %s)' % rows if rows is not None else ''
+                        self.stdout.write('UNINDEXED %s: %s%s\n' % (label, scan, estimate))
+                elif verbosity >= 1:
+                    self.stdout.write('OK %s\n' % label)
+
+        if failures:
+            raise CommandError('%d unaccent lookups are not served by an index' % failures)
+
+    def columns(self, field, lookup_type):
+        """Returns the columns an index serving the lookup is built on"""
+        if isinstance(field, list):
+            return [f.column for f in field]
+        shadow = UnaccentOperation.get_shadow_field(field, lookup_type)
+        return [field.column] + ([shadow.column] if shadow is not None else [])
+
+    def field_name(self, field):
+        if isinstance(field, list):
+            return '+'.join(f.name for f in field)
+        return field.name
+
+    def get_queryset(self, model, field, lookup_type, term, using):
+        """Returns the queryset filtered by the lookup, None if the lookup does not apply to the field"""
+        lookup = UnaccentOperation.lookups[lookup_type]
+        if lookup.multiple:
+            term = [term]
+        queryset = model._default_manager.using(using)
+
+        if isinstance(field, list):
+            # Concatenations are only indexed for the case insensitive lookups, see indexes.concat_index_sql
+            if lookup.lookup_type not in UnaccentOperation.case_insensitive_operators or lookup.multiple:
+                return None
+            return concat_filter(queryset, [f.name for f in field], lookup_type, term)
+        return queryset.filter(**{'%s__%s' % (field.name, lookup_type): term})
@@ -0,0 +1,65 @@
+# coding: utf-8
+from optparse import make_option
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from django_unaccent import indexes
+from django_unaccent.unaccent import UnaccentOperation
+
+
+class Command(BaseCommand):
+    args = '[app_label.Model.field ...]'
+    help = ("Creates the nondeterministic ICU collations comparing strings regardless of their accents "
+            "(PostgreSQL >= 12) and the indexes built with them for the given fields (defaults to the "
+            "UNACCENT_INDEXED_FIELDS setting). Set UNACCENT_USE_COLLATIONS = True afterwards so that the "
+            "%s lookups use them." % ', '.join(sorted(UnaccentOperation.collations)))
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to create the collations on. Defaults to the "default" database.'),
+        make_option('--drop', action='store_true', dest='drop', default=False,
+            help='Drop the indexes and the collations instead of creating them.'),
+        make_option('--sql', action='store_true', dest='print_sql', default=False,
+            help='Print the SQL statements instead of executing them.'),
+    )
+
+    def handle(self, *labels, **options):
+        using = options['database']
+        connection = connections[using]
+        if connection.vendor != 'postgresql':
+            raise CommandError('Nondeterministic collations require PostgreSQL')
+
+        try:
+            fields = indexes.get_indexed_fields(labels)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        statements = self.get_statements(fields, connection, **options)
+
+        if options['print_sql']:
+            self.stdout.write(';\n'.join(statements) + ';\n')
+            return
+
+        cursor = connection.cursor()
+        for sql in statements:
+            cursor.execute(sql)
+        transaction.commit_unless_managed(using=using)
+
+    def get_statements(self, fields, connection, **options):
+        collations = sorted(UnaccentOperation.collation_locales)
+        statements = []
+        if not options['drop']:
+            statements.extend(indexes.collation_sql(name, connection) for name in collations)
+
+        for model, field in fields:
+            # The collations do not apply to concatenations of fields, see indexes.concat_index_sql
+            if isinstance(field, list):
+                continue
+            for name, sql in indexes.collation_index_sql(model, field, connection):
+                statements.append(indexes.drop_index_sql(name, connection) if options['drop'] else sql)
+
+        if options['drop']:
+            statements.extend(indexes.drop_collation_sql(name, connection) for name in collations)
+        return statements
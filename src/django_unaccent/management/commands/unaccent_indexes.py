@@ -0,0 +1,76 @@
+# coding: utf-8
+from optparse import make_option
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from django_unaccent import indexes
+from django_unaccent.unaccent import UnaccentOperation
+
+
+class Command(BaseCommand):
+    args = '[app_label.Model.field[+field...] ...]'
+    help = ("Creates the IMMUTABLE unaccent wrapper function and the matching expression indexes "
+            "for the given fields (defaults to the UNACCENT_INDEXED_FIELDS setting). "
+            "Set UNACCENT_FUNCTION = '%s' afterwards so that lookups use them." % UnaccentOperation.immutable_function)
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to create the indexes on. Defaults to the "default" database.'),
+        make_option('--unaccent-schema', action='store', dest='unaccent_schema', default='public',
+            help='Schema the unaccent extension is installed in. Defaults to "public".'),
+        make_option('--no-pattern-ops', action='store_false', dest='pattern_ops', default=True,
+            help='Do not create the text_pattern_ops indexes used by the startswith_unaccent lookups.'),
+        make_option('--trigram', action='store_true', dest='trigram', default=False,
+            help='Also create the pg_trgm GIN indexes used by the contains_unaccent and endswith_unaccent lookups.'),
+        make_option('--keyset', action='store_true', dest='keyset', default=False,
+            help='Also create the (expression, primary key) indexes used by keyset_iterator.'),
+        make_option('--drop', action='store_true', dest='drop', default=False,
+            help='Drop all the indexes instead of creating them, whatever their options (the function is kept).'),
+        make_option('--sql', action='store_true', dest='print_sql', default=False,
+            help='Print the SQL statements instead of executing them.'),
+    )
+
+    def handle(self, *labels, **options):
+        using = options['database']
+        connection = connections[using]
+
+        try:
+            fields = indexes.get_indexed_fields(labels)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        statements = self.get_statements(fields, connection, **options)
+
+        if options['print_sql']:
+            self.stdout.write(';\n'.join(statements) + ';\n')
+            return
+
+        cursor = connection.cursor()
+        for sql in statements:
+            cursor.execute(sql)
+        transaction.commit_unless_managed(using=using)
+
+    def get_statements(self, fields, connection, **options):
+        statements = []
+        if options['drop']:
+            # Whatever options they were created with, every variant is dropped (if it exists)
+            options = dict(options, pattern_ops=True, trigram=True, keyset=True)
+        else:
+            statements.append(indexes.immutable_function_sql(schema=options.get('unaccent_schema', 'public'),
+                                                             connection=connection))
+            if options['trigram']:
+                statements.append(indexes.trigram_extension_sql())
+
+        for model, field in fields:
+            # Concatenations of fields are given as lists, see indexes.get_field
+            if isinstance(field, list):
+                index_sql = indexes.concat_index_sql(model, field, connection, pattern_ops=options['pattern_ops'],
+                                                     trigram=options['trigram'])
+            else:
+                index_sql = indexes.index_sql(model, field, connection, pattern_ops=options['pattern_ops'],
+                                              trigram=options['trigram'], keyset=options.get('keyset', False))
+            for name, sql in index_sql:
+                statements.append(indexes.drop_index_sql(name, connection) if options['drop'] else sql)
+        return statements
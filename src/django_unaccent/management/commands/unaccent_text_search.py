@@ -0,0 +1,67 @@
+# coding: utf-8
+from optparse import make_option
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from django_unaccent import indexes
+
+
+class Command(BaseCommand):
+    args = '[app_label.Model.field ...]'
+    help = ("Creates the text search configuration of the search_unaccent lookups (unaccent, then the dictionary "
+            "of the copied configuration) and the GIN indexes of the given fields (defaults to the "
+            "UNACCENT_INDEXED_FIELDS setting). Requires the unaccent extension.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to create the configuration on. Defaults to the "default" database.'),
+        make_option('--copy', action='store', dest='copy', default='simple',
+            help='Text search configuration the new one is copied from, eg: french. Defaults to simple.'),
+        make_option('--dictionary', action='store', dest='dictionary', default=None,
+            help='Dictionary applied after unaccent. Defaults to the stemmer of the copied configuration.'),
+        make_option('--drop', action='store_true', dest='drop', default=False,
+            help='Drop the indexes and the configuration instead of creating them.'),
+        make_option('--sql', action='store_true', dest='print_sql', default=False,
+            help='Print the SQL statements instead of executing them.'),
+    )
+
+    def handle(self, *labels, **options):
+        using = options['database']
+        connection = connections[using]
+        if connection.vendor != 'postgresql':
+            raise CommandError('Full text search requires PostgreSQL')
+
+        try:
+            fields = indexes.get_indexed_fields(labels)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        statements = self.get_statements(fields, connection, **options)
+
+        if options['print_sql']:
+            self.stdout.write(';\n'.join(statements) + ';\n')
+            return
+
+        cursor = connection.cursor()
+        for sql in statements:
+            cursor.execute(sql)
+        transaction.commit_unless_managed(using=using)
+
+    def get_statements(self, fields, connection, **options):
+        statements = []
+        if not options['drop']:
+            statements.append(indexes.text_search_config_sql(copy=options['copy'], dictionary=options['dictionary'],
+                                                             connection=connection))
+
+        for model, field in fields:
+            # Concatenations of fields are searched with concat_filter, see indexes.concat_index_sql
+            if isinstance(field, list):
+                continue
+            name, sql = indexes.text_search_index_sql(model, field, connection)
+            statements.append(indexes.drop_index_sql(name, connection) if options['drop'] else sql)
+
+        if options['drop']:
+            statements.append(indexes.drop_text_search_config_sql(connection=connection))
+        return statements
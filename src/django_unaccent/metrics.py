@@ -0,0 +1,185 @@
+# coding: utf-8
+"""Opt-in instrumentation of the unaccent lookups.
+
+Once enable_instrumentation() is called:
+
+* the `metrics' object counts, per lookup_type, the unaccent filters added to querysets, the fallbacks of the
+  smart operators and keeps a histogram of the execution time of the queries using them,
+* the signals of the signals module are sent,
+* the UNACCENT_METRICS_CALLBACK setting, a dotted path to a function, is called with (metric, lookup_type, value)
+  for every measure, eg: ('duration', 'icontains_unaccent', 0.012), to export them to a monitoring system,
+* queries slower than UNACCENT_SLOW_QUERY_THRESHOLD seconds are reported with the unaccent_slow_query signal.
+  If UNACCENT_EXPLAIN_SLOW_QUERIES is True, their EXPLAIN (ANALYZE, BUFFERS) output is attached (PostgreSQL only,
+  note that EXPLAIN ANALYZE runs the query again).
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.sql.compiler import SQLCompiler, SQLDeleteCompiler, SQLInsertCompiler, SQLUpdateCompiler
+from django.utils.importlib import import_module
+
+from . import signals
+from .unaccent import UnaccentOperation
+
+original_execute_sql = SQLCompiler.execute_sql
+
+logger = logging.getLogger('django_unaccent.metrics')
+
+
+class UnaccentMetrics(object):
+    """Thread safe counters and execution time histograms, per lookup_type"""
+
+    # Upper bounds, in seconds, of the buckets of the histograms, the last bucket holds the slower queries
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.callback = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.lookups = defaultdict(int)
+            self.fallbacks = defaultdict(int)
+            self.histograms = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+            self.durations = defaultdict(float)
+
+    def notify(self, metric, lookup_type, value):
+        if self.callback is not None:
+            self.callback(metric, lookup_type, value)
+
+    def record_lookup(self, lookup_type):
+        with self.lock:
+            self.lookups[lookup_type] += 1
+        self.notify('lookup', lookup_type, 1)
+
+    def record_fallback(self, lookup_type, fallback):
+        with self.lock:
+            self.fallbacks[lookup_type] += 1
+        signals.unaccent_fallback.send(sender=UnaccentOperation, lookup_type=lookup_type, fallback=fallback)
+        self.notify('fallback', lookup_type, 1)
+
+    def record_duration(self, lookup_type, duration):
+        with self.lock:
+            self.histograms[lookup_type][bisect_left(self.buckets, duration)] += 1
+            self.durations[lookup_type] += duration
+        self.notify('duration', lookup_type, duration)
+
+    def snapshot(self):
+        """Returns a copy of the metrics:
+            {'lookups': {lookup_type: count}, 'fallbacks': {lookup_type: count},
+             'durations': {lookup_type: {'count': count, 'total': seconds, 'histogram': [count per bucket]}}}
+        """
+        with self.lock:
+            return {
+                'lookups': dict(self.lookups),
+                'fallbacks': dict(self.fallbacks),
+                'durations': dict((lookup_type, {
+                    'count': sum(histogram),
+                    'total': self.durations[lookup_type],
+                    'histogram': list(histogram),
+                }) for lookup_type, histogram in self.histograms.iteritems()),
+            }
+
+    # Lookup types rendered by the queries being executed by the current thread, see instrumented_execute_sql
+    local = threading.local()
+
+    def rendered(self, lookup_type):
+        """Called by UnaccentNode.as_sql"""
+        rendered = getattr(self.local, 'rendered', None)
+        if rendered:
+            rendered[-1].add(lookup_type)
+
+
+metrics = UnaccentMetrics()
+
+
+def get_callback():
+    path = getattr(settings, 'UNACCENT_METRICS_CALLBACK', None)
+    if not path:
+        return None
+    module, _, name = path.rpartition('.')
+    return getattr(import_module(module), name)
+
+
+def explain(compiler, sql, params):
+    if compiler.connection.vendor != 'postgresql' or not getattr(settings, 'UNACCENT_EXPLAIN_SLOW_QUERIES', False):
+        return None
+    # EXPLAIN ANALYZE executes the query, never do it for writes
+    if isinstance(compiler, (SQLInsertCompiler, SQLDeleteCompiler, SQLUpdateCompiler)):
+        return None
+
+    # A failure must not abort the transaction of the caller
+    connection = compiler.connection
+    sid = connection.savepoint()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + sql, params)
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+    except Exception:
+        connection.savepoint_rollback(sid)
+        raise
+    connection.savepoint_commit(sid)
+    return plan
+
+
+def instrumented_execute_sql(self, *args, **kwargs):
+    """Times SQLCompiler.execute_sql for queries rendering unaccent lookups.
+
+    Only the queries which succeed are measured, the instrumentation never raises into the caller.
+    """
+    stack = getattr(metrics.local, 'rendered', None)
+    if stack is None:
+        stack = metrics.local.rendered = []
+
+    stack.append(set())
+    start = time.time()
+    try:
+        result = original_execute_sql(self, *args, **kwargs)
+    except Exception:
+        stack.pop()
+        raise
+
+    duration = time.time() - start
+    lookup_types = stack.pop()
+    if lookup_types:
+        try:
+            record_query(self, lookup_types, duration)
+        except Exception:
+            logger.exception('Could not record the unaccent query metrics')
+    return result
+
+
+def record_query(compiler, lookup_types, duration):
+    for lookup_type in lookup_types:
+        metrics.record_duration(lookup_type, duration)
+    signals.unaccent_query_executed.send(sender=UnaccentOperation, lookup_types=lookup_types,
+                                         duration=duration, connection=compiler.connection)
+
+    threshold = getattr(settings, 'UNACCENT_SLOW_QUERY_THRESHOLD', None)
+    if threshold is not None and duration >= threshold:
+        sql, params = compiler.as_sql()
+        try:
+            plan = explain(compiler, sql, params)
+        except Exception:
+            logger.exception('Could not explain a slow unaccent query')
+            plan = None
+        signals.unaccent_slow_query.send(sender=UnaccentOperation, lookup_types=lookup_types,
+                                         duration=duration, sql=sql, params=params,
+                                         plan=plan, connection=compiler.connection)
+
+
+def enable_instrumentation():
+    metrics.callback = get_callback()
+    UnaccentOperation.metrics = metrics
+    SQLCompiler.execute_sql = instrumented_execute_sql
+
+
+def disable_instrumentation():
+    UnaccentOperation.metrics = None
+    SQLCompiler.execute_sql = original_execute_sql
@@ -0,0 +1,176 @@
+# coding: utf-8
+"""Opt-in adaptive mode of the smart operators.
+
+By default the smart operators only look at the search term: without accents they unaccent, with accents they fall
+back to the plain Django lookup. Once enable_adaptive_planner() is called, the smart operators also pick the
+cheapest way to run the lookup:
+
+* 'fallback': the search term has accents, the plain Django lookup is used (as by default),
+* 'ascii': the search term is ascii and the column is declared ascii only by the UNACCENT_ASCII_FIELDS setting
+  (eg: ['auth.User.username']), unaccent would not change anything: the plain Django lookup is used,
+  and the plain indexes of the column with it. Only for the case sensitive exact and startswith lookups, the only
+  ones a plain index serves (Django renders the case insensitive ones as UPPER(column)),
+* 'unindexed': the LIKE lookup would be served by an index which can not help, because the search term of
+  a contains or endswith lookup is shorter than a trigram, or because the statistics of the column (pg_stats,
+  PostgreSQL only) estimate that too many rows match: the column is unaccented with the STABLE unaccent function,
+  which no expression index is built on, so that the planner scans the table instead of the whole index,
+* 'adaptive': the statistics are looked at when the query is rendered, on the database it runs on: the lookup is
+  then 'unindexed' or 'unaccent',
+* 'unaccent': the default treatment.
+
+Only the expression indexes of the IMMUTABLE wrapper can be avoided: the LIKE lookups are never 'unindexed' unless
+UNACCENT_FUNCTION is UnaccentOperation.immutable_function (the unaccent function itself can not be indexed), and
+the shadow fields and the collations are used as by default.
+
+Each decision is sent with the unaccent_planned signal and logged (at the DEBUG level) by the django_unaccent.planner
+logger, plan() returns it without building a query (pass a connection to look at its statistics):
+
+    planner.plan(User._meta.get_field('username'), 'icontains_unaccent_smart', u'jo')
+    # UnaccentDecision(strategy='unindexed', accepted=True, lookup_type='icontains_unaccent', function='unaccent',
+    #                  reason='search term shorter than a trigram')
+
+The statistics are read once per column and connection every `stats_timeout' seconds. Only the most common values
+are looked at: the selectivity is a lower bound.
+"""
+
+from collections import namedtuple
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from . import indexes, signals
+from .evaluator import compile_lookup
+from .unaccent import UnaccentOperation
+
+logger = logging.getLogger('django_unaccent.planner')
+
+UnaccentDecision = namedtuple('UnaccentDecision', 'strategy accepted lookup_type function reason')
+
+
+class UnaccentPlanner(object):
+
+    # Search terms of contains and endswith lookups shorter than this do not make a single trigram
+    min_trigram_length = 3
+
+    def __init__(self, max_selectivity=0.2, stats_timeout=300):
+        """
+        Args:
+            max_selectivity: share of the rows matched above which the trigram indexes are not used
+            stats_timeout: lifetime of the statistics of a column, in seconds
+        """
+        self.max_selectivity = max_selectivity
+        self.stats_timeout = stats_timeout
+        # (UNACCENT_ASCII_FIELDS, set of (model, field name)), see is_ascii_field
+        self.ascii_fields = (None, frozenset())
+
+    def is_ascii_field(self, field):
+        labels = getattr(settings, 'UNACCENT_ASCII_FIELDS', ())
+        if labels != self.ascii_fields[0]:
+            fields = map(indexes.get_field, labels)
+            concatenations = [label for label, (model, field) in zip(labels, fields) if isinstance(field, list)]
+            if concatenations:
+                raise ImproperlyConfigured("UNACCENT_ASCII_FIELDS can not list concatenations of fields: %s"
+                                           % ', '.join(concatenations))
+            self.ascii_fields = (labels, frozenset((model, field.name) for model, field in fields))
+        return (field.model, field.name) in self.ascii_fields[1]
+
+    def column_stats(self, field, connection):
+        """Returns the [(value, frequency)] of the most common values of the column, or None without statistics"""
+        cache = connection.__dict__.setdefault('unaccent_column_stats', {})
+        key = (field.model._meta.db_table, field.column)
+        expires, stats = cache.get(key, (0, None))
+        if expires > time.time():
+            return stats
+
+        cursor = connection.cursor()
+        cursor.execute("SELECT most_common_vals::text::text[], most_common_freqs FROM pg_stats "
+                       "WHERE schemaname = ANY(current_schemas(false)) AND tablename = %s AND attname = %s",
+                       key)
+        row = cursor.fetchone()
+        if row is None:
+            stats = None
+        else:
+            stats = zip(row[0] or (), row[1] or ())
+        cache[key] = (time.time() + self.stats_timeout, stats)
+        return stats
+
+    def selectivity(self, field, lookup_type, term, connection):
+        """Returns the estimated share of the rows matched by the lookup, or None if it can not be estimated"""
+        if connection.vendor != 'postgresql':
+            return None
+        stats = self.column_stats(field, connection)
+        if stats is None:
+            return None
+
+        matches = compile_lookup(lookup_type, term)
+        return sum(frequency for value, frequency in stats if matches(value))
+
+    def decide(self, lookup_type, strategy, accepted, new_lookup_type, function=None, reason=''):
+        decision = UnaccentDecision(strategy, accepted, new_lookup_type, function, reason)
+        logger.debug('%s: %s (%s)', lookup_type, strategy, reason)
+        signals.unaccent_planned.send(sender=UnaccentOperation, lookup_type=lookup_type, decision=decision)
+        return decision
+
+    def plan(self, field, lookup_type, search_term, connection=None):
+        """Returns the UnaccentDecision of a lookup, see UnaccentOperation.accept for the other lookup_types.
+
+        Args:
+            connection: the database whose statistics are looked at, without it the decision is left to
+                        rendering_function (the 'adaptive' strategy)
+        """
+        lookup = UnaccentOperation.lookups.get(lookup_type)
+        accepted, new_lookup_type = UnaccentOperation.accept(lookup_type, search_term)
+        if lookup is None or not lookup.smart:
+            return UnaccentDecision('unaccent', accepted, new_lookup_type, None, '')
+
+        if not accepted:
+            return self.decide(lookup_type, 'fallback', False, new_lookup_type, reason='accents in the search term')
+        if lookup.multiple or lookup.text_search:
+            return self.decide(lookup_type, 'unaccent', True, new_lookup_type, reason='no alternative')
+
+        if self.is_ascii_field(field) and not lookup.case_insensitive and \
+                not (lookup.like_pattern or '').startswith('%'):
+            if UnaccentOperation.metrics is not None:
+                UnaccentOperation.metrics.record_fallback(lookup_type, lookup.fallback)
+            return self.decide(lookup_type, 'ascii', False, lookup.fallback, reason='ascii search term and column')
+
+        if lookup.like_pattern is None:
+            return self.decide(lookup_type, 'unaccent', True, new_lookup_type, reason='equality')
+        if UnaccentOperation.get_function() != UnaccentOperation.immutable_function:
+            return self.decide(lookup_type, 'unaccent', True, new_lookup_type, reason='no expression index')
+
+        if lookup.like_pattern.startswith('%') and len(search_term) < self.min_trigram_length:
+            return self.decide(lookup_type, 'unindexed', True, new_lookup_type, 'unaccent',
+                               'search term shorter than a trigram')
+
+        if connection is None:
+            return self.decide(lookup_type, 'adaptive', True, new_lookup_type, reason='statistics not read yet')
+        return self.plan_selectivity(lookup_type, field, new_lookup_type, search_term, connection)
+
+    def plan_selectivity(self, lookup_type, field, new_lookup_type, search_term, connection):
+        selectivity = self.selectivity(field, new_lookup_type, search_term, connection)
+        if selectivity is not None and selectivity >= self.max_selectivity:
+            return self.decide(lookup_type, 'unindexed', True, new_lookup_type, 'unaccent',
+                               '%.0f%% of the rows match' % (selectivity * 100))
+
+        return self.decide(lookup_type, 'unaccent', True, new_lookup_type,
+                           reason='selectivity unknown' if selectivity is None else
+                                  '%.0f%% of the rows match' % (selectivity * 100))
+
+    def rendering_function(self, node, connection):
+        """Returns the function unaccenting the column of an 'adaptive' node rendered for `connection'"""
+        lookup_type = UnaccentOperation.lookups[node.lookup_type].lookup_type + '_smart'
+        return self.plan_selectivity(lookup_type, node.field, node.lookup_type, node.value, connection).function
+
+
+planner = UnaccentPlanner()
+
+
+def enable_adaptive_planner():
+    UnaccentOperation.planner = planner
+
+
+def disable_adaptive_planner():
+    UnaccentOperation.planner = None
@@ -0,0 +1,163 @@
+# coding: utf-8
+"""Opt-in in-process index answering istartswith_unaccent prefix lookups without querying the database,
+eg: for autocompletion.
+
+    index = register_prefix_index(City, 'name')
+
+    index.search(u'sao p')                    # primary keys of the cities whose name starts with 'sao p'
+    index.filter(City.objects.all(), u'são')  # City.objects.filter(pk__in=...)
+
+The index is a sorted array of the normalized values (unaccented with the rules of the database, see
+rules.unaccent, and upper-cased) and a parallel array of primary keys, it is built on the first lookup and kept
+up to date by the post_save and post_delete signals of the database the model is written to (see
+router.db_for_write). Changes which do not send these signals (QuerySet.update(), bulk_create(), raw SQL,
+other processes) are not seen: call invalidate() so that the index is rebuilt on the next lookup.
+
+None and empty prefixes match nothing.
+"""
+
+from array import array
+from bisect import bisect_left
+import threading
+
+from django.db import router
+from django.db.models import AutoField
+from django.db.models.signals import post_delete, post_save
+
+from .unaccent import UnaccentOperation
+
+# (model, field name) -> UnaccentPrefixIndex, see register_prefix_index
+prefix_indexes = {}
+
+
+class UnaccentPrefixIndex(object):
+    """Sorted array of the normalized values of a model field, mapped to the primary keys of their rows"""
+
+    def __init__(self, model, field_name, using=None):
+        self.model = model
+        self.field = model._meta.get_field(field_name)
+        self.using = using or router.db_for_read(model)
+        self.lock = threading.Lock()
+        # Built on the first lookup, see build
+        self.keys = None
+        self.pks = None
+        self.values = None
+
+    @staticmethod
+    def normalize(value):
+        """The normalization of the istartswith_unaccent lookup"""
+        return UnaccentOperation.normalize('istartswith_unaccent', value)
+
+    def new_pks(self):
+        # Integer primary keys are stored in a compact array
+        return array('l') if isinstance(self.model._meta.pk, AutoField) else []
+
+    def build(self):
+        """Loads the values of the field, sorted by normalized value"""
+        queryset = self.model._default_manager.using(self.using).exclude(**{self.field.attname: None})
+        rows = sorted((self.normalize(value), pk) for pk, value in queryset.values_list('pk', self.field.attname))
+
+        pks = self.new_pks()
+        pks.extend(pk for _, pk in rows)
+        self.keys = [key for key, _ in rows]
+        self.pks = pks
+        self.values = dict((pk, key) for key, pk in rows)
+
+    def invalidate(self):
+        """Drops the index, rebuilt on the next lookup"""
+        with self.lock:
+            self.keys = self.pks = self.values = None
+
+    def search(self, prefix, limit=None):
+        """Returns the primary keys of the rows whose value starts with `prefix', ordered by value.
+
+        Args:
+            limit: maximum number of primary keys returned
+        """
+        prefix = self.normalize(prefix) if prefix is not None else None
+        if not prefix:
+            return []
+        with self.lock:
+            if self.keys is None:
+                self.build()
+            keys = self.keys
+            start = bisect_left(keys, prefix)
+            end = len(keys) if limit is None else min(len(keys), start + limit)
+
+            pks = []
+            for i in xrange(start, end):
+                if not keys[i].startswith(prefix):
+                    break
+                pks.append(self.pks[i])
+            return pks
+
+    def filter(self, queryset, prefix, limit=None):
+        """Returns `queryset' filtered as by istartswith_unaccent=prefix, without the unaccent function"""
+        return queryset.filter(pk__in=self.search(prefix, limit))
+
+    def add(self, pk, value):
+        key = self.normalize(value)
+        i = bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.pks.insert(i, pk)
+        self.values[pk] = key
+
+    def remove(self, pk):
+        key = self.values.pop(pk, None)
+        if key is None:
+            return
+        i = bisect_left(self.keys, key)
+        while self.pks[i] != pk:
+            i += 1
+        del self.keys[i]
+        del self.pks[i]
+
+    def is_indexed_database(self, instance, using):
+        """Whether a change made on `using' is seen by the database the index is read from"""
+        return using in (self.using, router.db_for_write(self.model, instance=instance))
+
+    def post_save(self, sender, instance, using=None, **kwargs):
+        if not self.is_indexed_database(instance, using):
+            return
+        with self.lock:
+            if self.keys is None:
+                return
+            self.remove(instance.pk)
+            value = getattr(instance, self.field.attname)
+            if value is not None:
+                self.add(instance.pk, value)
+
+    def post_delete(self, sender, instance, using=None, **kwargs):
+        if not self.is_indexed_database(instance, using):
+            return
+        with self.lock:
+            if self.keys is not None:
+                self.remove(instance.pk)
+
+
+def signals_dispatch_uid(model, field_name):
+    return 'django_unaccent.prefix.%s.%s.%s' % (model._meta.app_label, model._meta.object_name, field_name)
+
+
+def register_prefix_index(model, field_name, using=None):
+    """Returns the prefix index of a model field, created and connected to the model signals on the first call"""
+    index = prefix_indexes.get((model, field_name))
+    if index is None:
+        index = prefix_indexes[(model, field_name)] = UnaccentPrefixIndex(model, field_name, using)
+        dispatch_uid = signals_dispatch_uid(model, field_name)
+        post_save.connect(index.post_save, sender=model, weak=False, dispatch_uid=dispatch_uid)
+        post_delete.connect(index.post_delete, sender=model, weak=False, dispatch_uid=dispatch_uid)
+    return index
+
+
+def unregister_prefix_index(model, field_name):
+    index = prefix_indexes.pop((model, field_name), None)
+    if index is not None:
+        dispatch_uid = signals_dispatch_uid(model, field_name)
+        post_save.disconnect(sender=model, dispatch_uid=dispatch_uid)
+        post_delete.disconnect(sender=model, dispatch_uid=dispatch_uid)
+
+
+def get_prefix_index(model, field_name):
+    """Returns the registered prefix index of a model field, or None"""
+    return prefix_indexes.get((model, field_name))
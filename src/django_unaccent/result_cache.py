@@ -0,0 +1,175 @@
+# coding: utf-8
+"""Opt-in cache of the primary keys matched by unaccent lookups, stored with Django's cache framework.
+
+    from django_unaccent.result_cache import result_cache
+
+    result_cache.register(City)  # at start up, in every process saving cities
+    result_cache.filter(City.objects.all(), 'name', 'iunaccent', u'São Paulo')  # City.objects.filter(pk__in=...)
+
+Entries are keyed by (model, field, normalized term, lookup_type): the term is normalized as the database does
+(see UnaccentOperation.normalize), so that the accent and case variants of a term share the same entry.
+
+The entries of a model are invalidated at once when one of its instances is saved or deleted: the keys include
+a generation number of the model, stored in the cache and incremented by the post_save and post_delete signals.
+Call invalidate() after changes which do not send them (update(), bulk_create(), other processes).
+
+Settings:
+    UNACCENT_RESULT_CACHE: alias of the cache to use (defaults to 'default')
+    UNACCENT_RESULT_CACHE_TIMEOUT: lifetime of the entries, in seconds (defaults to 300)
+    UNACCENT_RESULT_CACHE_MAX_RESULTS: searches matching more rows are not cached (defaults to 1000)
+
+The memory used is bounded by the timeout and by the cache backend (eg: MAX_ENTRIES of the locmem backend).
+"""
+
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.db import router
+from django.db.models.signals import post_delete, post_save
+
+from .unaccent import UnaccentOperation
+
+
+class UnaccentResultCache(object):
+
+    key_prefix = 'django_unaccent'
+
+    def __init__(self, cache_alias=None, timeout=None, max_results=None):
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self.max_results = max_results
+        self._cache = None
+        self.lock = threading.Lock()
+        self.models = set()
+        self.reset_stats()
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            from django.core.cache import get_cache
+            self._cache = get_cache(self.cache_alias or getattr(settings, 'UNACCENT_RESULT_CACHE', 'default'))
+        return self._cache
+
+    def get_timeout(self):
+        if self.timeout is not None:
+            return self.timeout
+        return getattr(settings, 'UNACCENT_RESULT_CACHE_TIMEOUT', 300)
+
+    def get_max_results(self):
+        if self.max_results is not None:
+            return self.max_results
+        return getattr(settings, 'UNACCENT_RESULT_CACHE_MAX_RESULTS', 1000)
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns {'hits': count, 'misses': count, 'hit_ratio': hits / lookups}"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+    def register(self, model):
+        """Invalidates the entries of `model' when one of its instances is saved or deleted"""
+        if model in self.models:
+            return
+        self.models.add(model)
+        dispatch_uid = 'django_unaccent.result_cache.%s.%s.%s' % (id(self), model._meta.app_label,
+                                                                  model._meta.object_name)
+        post_save.connect(self.invalidate, sender=model, weak=False, dispatch_uid=dispatch_uid)
+        post_delete.connect(self.invalidate, sender=model, weak=False, dispatch_uid=dispatch_uid)
+
+    def model_key(self, model):
+        return '%s:%s.%s' % (self.key_prefix, model._meta.app_label, model._meta.object_name)
+
+    @staticmethod
+    def new_generation():
+        # Never reuses the generation of entries which may still exist, even if the counter was evicted
+        return int(time.time() * 1000)
+
+    def generation(self, model):
+        key = self.model_key(model) + ':generation'
+        generation = self.cache.get(key)
+        if generation is None:
+            self.cache.add(key, self.new_generation())
+            generation = self.cache.get(key)
+        return generation
+
+    def invalidate(self, sender, **kwargs):
+        """Drops the entries of the `sender' model, may be used as a signal receiver"""
+        key = self.model_key(sender) + ':generation'
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, self.new_generation())
+
+    def key(self, model, field_name, lookup_type, term, using):
+        normalized = UnaccentOperation.normalize(lookup_type, term)
+        # Hashed to get keys of a bounded length made of safe characters, as memcached requires
+        digest = hashlib.md5(normalized.encode('utf-8')).hexdigest()
+        return '%s:%s:%s:%s:%s:%s' % (self.model_key(model), self.generation(model), using, field_name,
+                                      lookup_type, digest)
+
+    def cached_search(self, model, field_name, lookup_type, term, using):
+        """Returns the primary keys of the rows matched by the lookup, or None if there are more than max_results
+        (they are not cached)
+        """
+        lookup = UnaccentOperation.lookups[lookup_type]
+        if lookup.smart or lookup.multiple:
+            raise ValueError("The results of the %s lookup cannot be cached" % lookup_type)
+        self.register(model)
+
+        key = self.key(model, field_name, lookup_type, term, using)
+        pks = self.cache.get(key)
+        with self.lock:
+            if pks is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if pks is not None:
+            return pks
+
+        max_results = self.get_max_results()
+        pks = list(self.lookup_queryset(model, field_name, lookup_type, term, using)
+                   .order_by().values_list('pk', flat=True)[:max_results + 1])
+        if len(pks) > max_results:
+            return None
+        self.cache.set(key, pks, self.get_timeout())
+        return pks
+
+    def lookup_queryset(self, model, field_name, lookup_type, term, using):
+        return model._default_manager.using(using).filter(**{'%s__%s' % (field_name, lookup_type): term})
+
+    def search(self, model, field_name, lookup_type, term, using=None):
+        """Returns the primary keys of the rows of `model' matched by field_name__lookup_type=term.
+
+        Only the accent insensitive lookups are accepted: the smart ones are not, as their result depends
+        on the accents of the term. Searches matching more than max_results rows are run without the cache.
+        """
+        using = using or router.db_for_read(model)
+        pks = self.cached_search(model, field_name, lookup_type, term, using)
+        if pks is None:
+            pks = list(self.lookup_queryset(model, field_name, lookup_type, term, using)
+                       .order_by().values_list('pk', flat=True))
+        return pks
+
+    def filter(self, queryset, field_name, lookup_type, term):
+        """Returns `queryset' filtered as by field_name__lookup_type=term, through the cached primary keys.
+
+        Searches matching more than max_results rows are filtered by the lookup itself.
+        """
+        pks = self.cached_search(queryset.model, field_name, lookup_type, term, queryset.db)
+        if pks is None:
+            return queryset.filter(**{'%s__%s' % (field_name, lookup_type): term})
+        return queryset.filter(pk__in=pks)
+
+
+result_cache = UnaccentResultCache()
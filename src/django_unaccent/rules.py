@@ -0,0 +1,146 @@
+# coding: utf-8
+"""Pure Python unaccent engine, following the rules of PostgreSQL's unaccent dictionary.
+
+The rules are read from a file in the format of PostgreSQL's unaccent.rules (one rule per line: the source
+character, a tab, the replacement) and compiled once into a translation table for unicode.translate.
+The file shipped with django-unaccent mirrors PostgreSQL's rules; set UNACCENT_RULES_FILE to the file used
+by your server (eg: $(pg_config --sharedir)/tsearch_data/unaccent.rules) for an exact parity.
+
+As PostgreSQL's unaccent, characters without any rule are left untouched.
+"""
+
+import codecs
+import os
+import re
+
+from django.conf import settings
+from django.test.signals import setting_changed
+
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'unaccent.rules')
+
+_translation_tables = {}
+# Table of the current rules file, spares reading the setting on every call, see get_translation_table
+_current_table = None
+
+
+def get_rules_file():
+    return getattr(settings, 'UNACCENT_RULES_FILE', DEFAULT_RULES_FILE)
+
+
+# Separators of the rules, as unaccent.c: non ascii spaces (eg: no-break space) are rule sources
+whitespace = frozenset(u' \t\n\r\f\v')
+
+
+def parse_rule(line):
+    """Returns the (source, replacement) of a line of an unaccent.rules file, as parsed by PostgreSQL's unaccent.c,
+    or None for blank and invalid lines.
+
+    The source and the replacement are separated by whitespace. The replacement may be double-quoted to hold
+    whitespace ("" is an escaped quote, PostgreSQL >= 13), a rule without replacement removes the source.
+    """
+    source, replacement = u'', u''
+    # Position in the line, as the states of unaccent.c: 0 before the source, 1 in the source, 2 before the
+    # replacement, 3 in the replacement, 4 in the quoted replacement, 5 after the replacement
+    state = 0
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if state == 0:
+            if not char in whitespace:
+                source, state = char, 1
+        elif state == 1:
+            if char in whitespace:
+                state = 2
+            else:
+                source += char
+        elif state == 2:
+            if char == u'"':
+                state = 4
+            elif not char in whitespace:
+                replacement, state = char, 3
+        elif state == 3:
+            if char in whitespace:
+                state = 5
+            else:
+                replacement += char
+        elif state == 4:
+            if char == u'"':
+                if line[i + 1:i + 2] == u'"':
+                    replacement += char
+                    i += 1
+                else:
+                    state = 5
+            else:
+                replacement += char
+        elif not char in whitespace:
+            # More than two strings, PostgreSQL warns and skips the rule
+            return None
+        i += 1
+
+    if state == 0:
+        return None
+    return source, replacement
+
+
+def load_rules(path):
+    """Returns the {source: replacement} rules of an unaccent.rules file, see parse_rule"""
+    rules = {}
+    with codecs.open(path, encoding='utf-8') as rules_file:
+        for line in rules_file:
+            rule = parse_rule(line)
+            if rule is not None:
+                rules[rule[0]] = rule[1]
+    return rules
+
+
+class TranslationTable(object):
+    """Rules compiled for unicode.translate, the (rare) multi-characters sources are applied with a regexp."""
+
+    def __init__(self, rules):
+        self.table = dict((ord(source), replacement) for source, replacement in rules.iteritems()
+                          if len(source) == 1)
+        sequences = sorted((source for source in rules if len(source) > 1), key=len, reverse=True)
+        self.sequences = dict((source, rules[source]) for source in sequences)
+        self.sequences_re = re.compile(u'|'.join(map(re.escape, sequences)), re.UNICODE) if sequences else None
+        # Whether ascii strings are left untouched, which allows the fast paths of asciify and has_accents
+        self.ascii_identity = not any(all(ord(char) < 128 for char in source) for source in rules)
+
+    def translate(self, unistr):
+        if self.sequences_re is not None:
+            unistr = self.sequences_re.sub(lambda match: self.sequences[match.group(0)], unistr)
+        return unistr.translate(self.table)
+
+
+def get_translation_table(path=None):
+    """Returns the TranslationTable compiled from the rules file, loaded once per path"""
+    global _current_table
+    if path is None and _current_table is not None:
+        return _current_table
+
+    table_path = path or get_rules_file()
+    table = _translation_tables.get(table_path)
+    if table is None:
+        table = _translation_tables[table_path] = TranslationTable(load_rules(table_path))
+    if path is None:
+        _current_table = table
+    return table
+
+
+def reset_current_table(setting=None, **kwargs):
+    global _current_table
+    if setting == 'UNACCENT_RULES_FILE':
+        _current_table = None
+
+setting_changed.connect(reset_current_table, dispatch_uid='django_unaccent.rules.reset_current_table')
+
+
+def unaccent(unistr):
+    """Python counterpart of PostgreSQL's unaccent() function.
+
+    >>> unaccent(u'Ééüçñøàæ')
+    u'Eeucnoaae'
+    """
+    if unistr is None:
+        return None
+    return get_translation_table().translate(unicode(unistr))
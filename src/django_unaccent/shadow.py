@@ -0,0 +1,171 @@
+# coding: utf-8
+"""Denormalized unaccent mode: a shadow column holds the pre-normalized (unaccented, optionally upper-cased)
+value of another field, so that lookups compare against a plain, indexable column and no unaccent function
+is evaluated for each row.
+
+    class Person(models.Model):
+        name = models.CharField(max_length=100)
+        name_iunaccent = UnaccentShadowField('name', upper=True)
+
+        objects = UnaccentShadowManager()
+
+    Person.objects.filter(name__icontains_unaccent=u'tae')  # WHERE name_iunaccent LIKE '%TAE%'
+
+Shadow columns are kept in sync by save(), bulk_create() and the UnaccentShadowManager's update().
+Existing rows are filled in with the unaccent_backfill management command (see backfill_shadow_fields).
+"""
+
+from django.db import connections, models, transaction, router
+from django.db.models.expressions import ExpressionNode
+from django.db.models.query import QuerySet
+from django.db.models.signals import class_prepared
+from django.utils.encoding import smart_unicode
+
+from . import rules
+from .unaccent import UnaccentOperation
+
+
+class UnaccentShadowField(models.Field):
+    """Read only field storing the normalized value of its `source' field.
+
+    Case insensitive lookups (iunaccent, icontains_unaccent...) are served by an upper-cased shadow field,
+    the case sensitive ones by a non upper-cased shadow field.
+
+    The column is a varchar of the max_length of the source field, or a text column if the source is a TextField.
+    Pass a larger max_length if the rules expand characters of the values (eg: u'Æ' -> u'AE').
+    """
+
+    def __init__(self, source, upper=False, *args, **kwargs):
+        self.source = source
+        self.upper = upper
+        # Defaults to the max_length of the source, see resolve_max_length
+        self.inherit_max_length = 'max_length' not in kwargs
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('db_index', True)
+        # Allows adding the column to existing tables before running the backfill
+        kwargs.setdefault('null', True)
+        super(UnaccentShadowField, self).__init__(*args, **kwargs)
+
+    def contribute_to_class(self, cls, name):
+        super(UnaccentShadowField, self).contribute_to_class(cls, name)
+        if not cls._meta.abstract:
+            UnaccentOperation.register_shadow_field(cls, self.source, self.upper, self)
+            if self.inherit_max_length:
+                # The source field may be added to the class after this one
+                class_prepared.connect(self.resolve_max_length, sender=cls, weak=False)
+
+    def resolve_max_length(self, sender, **kwargs):
+        source = sender._meta.get_field(self.source)
+        self.max_length = None if isinstance(source, models.TextField) else source.max_length
+
+    def get_internal_type(self):
+        return 'TextField' if self.max_length is None else 'CharField'
+
+    def to_python(self, value):
+        if isinstance(value, basestring) or value is None:
+            return value
+        return smart_unicode(value)
+
+    def get_prep_value(self, value):
+        return self.to_python(value)
+
+    def normalize(self, value):
+        """Normalizes as the database does (see rules.unaccent): characters without rule are kept"""
+        if value is None:
+            return None
+        value = rules.unaccent(value)
+        return value.upper() if self.upper else value
+
+    def pre_save(self, model_instance, add):
+        """Called by save() and bulk_create(), refreshes the shadow value from the source field"""
+        source_field = model_instance._meta.get_field(self.source)
+        value = self.normalize(getattr(model_instance, source_field.attname))
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+def get_shadow_fields(model):
+    """Returns the shadow fields of a model"""
+    return [f for f in model._meta.fields if isinstance(f, UnaccentShadowField)]
+
+
+class UnaccentShadowQuerySet(QuerySet):
+
+    def update(self, **kwargs):
+        """Also updates the shadow fields whose source is updated.
+
+        Plain values are normalized in Python, shadow fields whose source is updated with an expression
+        (eg: F('name')) are refreshed from the database once the update is done.
+        """
+        deferred = []
+        for shadow in get_shadow_fields(self.model):
+            if shadow.source not in kwargs or shadow.name in kwargs:
+                continue
+            value = kwargs[shadow.source]
+            if isinstance(value, ExpressionNode):
+                deferred.append(shadow)
+            else:
+                kwargs[shadow.name] = shadow.normalize(value)
+
+        if not deferred:
+            return super(UnaccentShadowQuerySet, self).update(**kwargs)
+
+        # The update may change the rows matched by the queryset: fetch them first
+        pks = list(self.values_list('pk', flat=True))
+        rows = super(UnaccentShadowQuerySet, self).update(**kwargs)
+        backfill_shadow_fields(self.model, self.model._default_manager.using(self.db).filter(pk__in=pks), deferred)
+        return rows
+    update.alters_data = True
+
+
+class UnaccentShadowManager(models.Manager):
+    """Manager whose querysets keep the shadow fields in sync on update()"""
+    use_for_related_fields = True
+
+    def get_query_set(self):
+        return UnaccentShadowQuerySet(self.model, using=self._db)
+
+
+def backfill_shadow_fields(model, queryset=None, shadows=None, batch_size=1000):
+    """Recomputes the shadow fields of the rows of `queryset' (defaults to all the rows of the model)
+    in batches of `batch_size' rows, each batch being committed on its own.
+
+    Returns:
+        the number of updated rows
+    """
+    shadows = shadows or get_shadow_fields(model)
+    if not shadows:
+        return 0
+
+    if queryset is None:
+        queryset = model._default_manager.all()
+    using = queryset._db or router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+
+    pk = model._meta.pk
+    sources = [model._meta.get_field(shadow.source) for shadow in shadows]
+    update_sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        qn(model._meta.db_table),
+        ', '.join('%s = %%s' % qn(shadow.column) for shadow in shadows),
+        qn(pk.column),
+    )
+
+    queryset = queryset.using(using).order_by('pk').values_list('pk', *[source.attname for source in sources])
+    count, last_pk = 0, None
+    while True:
+        batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(batch[:batch_size])
+        if not rows:
+            break
+
+        params = []
+        for row in rows:
+            values = [shadow.normalize(value) for shadow, value in zip(shadows, row[1:])]
+            params.append(values + [row[0]])
+        connection.cursor().executemany(update_sql, params)
+        transaction.commit_unless_managed(using=using)
+
+        count += len(rows)
+        last_pk = rows[-1][0]
+    return count
@@ -0,0 +1,18 @@
+# coding: utf-8
+"""Signals sent once the instrumentation is enabled (see metrics.enable_instrumentation)."""
+
+from django.dispatch import Signal
+
+
+# A smart operator fell back to its non unaccent lookup_type (see UnaccentOperation.accept)
+unaccent_fallback = Signal(providing_args=['lookup_type', 'fallback'])
+
+# A query using unaccent lookups was executed, lookup_types lists the distinct unaccent lookup_types it used
+unaccent_query_executed = Signal(providing_args=['lookup_types', 'duration', 'connection'])
+
+# A query went over UNACCENT_SLOW_QUERY_THRESHOLD, plan is its EXPLAIN (ANALYZE, BUFFERS) output or None
+unaccent_slow_query = Signal(providing_args=['lookup_types', 'duration', 'sql', 'params', 'plan', 'connection'])
+
+# The adaptive planner chose how to run a smart lookup, decision is a planner.UnaccentDecision
+# (sent once planner.enable_adaptive_planner is called)
+unaccent_planned = Signal(providing_args=['lookup_type', 'decision'])
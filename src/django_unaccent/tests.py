@@ -1,17 +1,58 @@
 # vim: set fileencoding=utf-8 :
 
-from django.contrib.auth.models import User
-from django.db.models import Q
+import copy
+import pickle
+from StringIO import StringIO
+
+from django.contrib.auth.models import Group, User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, connections, models, router, DatabaseError
+from django.db.models import F, Q
+from django.db.models.signals import post_save
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.utils import unittest
 
 
-from .unaccent import monkey_patch_where_node
+from .evaluator import compile_lookup, unaccent_filter
+from .indexes import (INDEX_VARIANTS, KEYSET_INDEX_VARIANTS, TRIGRAM_INDEX_VARIANTS, concat_index_sql,
+                      immutable_function_sql, index_name, index_sql)
+from .keyset import keyset_iterator
+from .management.commands.unaccent_check_indexes import postgresql_unindexed_scans
+from . import metrics as metrics_module
+from .metrics import disable_instrumentation, enable_instrumentation, metrics
+from .planner import disable_adaptive_planner, enable_adaptive_planner, planner
+from .prefix import register_prefix_index, unregister_prefix_index, UnaccentPrefixIndex
+from .result_cache import UnaccentResultCache
+from .signals import unaccent_planned, unaccent_slow_query
+from .rules import parse_rule, unaccent
+from .shadow import UnaccentShadowField, UnaccentShadowManager
+from .unaccent import asciify, asciify_many, concat_filter, has_accents, monkey_patch_where_node, UnaccentNode, UnaccentOperation
 
 
 monkey_patch_where_node()
 
 
+class Person(models.Model):
+    name = models.CharField(max_length=100)
+    name_unaccent = UnaccentShadowField('name')
+    name_iunaccent = UnaccentShadowField('name', upper=True)
+
+    objects = UnaccentShadowManager()
+
+    class Meta:
+        app_label = 'django_unaccent'
+
+
+class Note(models.Model):
+    text = models.TextField()
+    text_iunaccent = UnaccentShadowField('text', upper=True)
+
+    class Meta:
+        app_label = 'django_unaccent'
+
+
 class UnaccentTestCase(TestCase):
 
     def setUp(self):
@@ -35,6 +76,12 @@ class UnaccentTestCase(TestCase):
         # Additional test with the Q syntax
         self.assertTrue(User.objects.filter(Q(*args, **kwargs)).exists())
 
+    def assert_match_ignoring_case(self, filtr, value):
+        """As Django's, the smart operators fallbacks on SQLite only fold the case of ascii chars"""
+        if connection.vendor == 'sqlite' and filtr.endswith('_smart') and asciify(value) != value:
+            return
+        self.assert_match((filtr, value))
+
     def assert_no_match(self, *args, **kwargs):
         self.assertFalse(User.objects.filter(*args, **kwargs).exists())
         # Additional test with the Q syntax
@@ -57,8 +104,8 @@ class UnaccentTestCase(TestCase):
         for filtr in ('username__iunaccent', 'username__iunaccent_smart'):
             self.assert_match((filtr, self.username))
             self.assert_match((filtr, self.ascii_username))
-            self.assert_match((filtr, self.username.lower()))
-            self.assert_match((filtr, self.username.upper()))
+            self.assert_match_ignoring_case(filtr, self.username.lower())
+            self.assert_match_ignoring_case(filtr, self.username.upper())
             self.assert_match((filtr, self.ascii_username.lower()))
             self.assert_match((filtr, self.ascii_username.upper()))
             self.assert_no_match((filtr, self.username[1:]))
@@ -84,9 +131,9 @@ class UnaccentTestCase(TestCase):
         for filtr in ('username__icontains_unaccent', 'username__icontains_unaccent_smart'):
             self.assert_match((filtr, self.username[1:-1]))
             self.assert_match((filtr, self.ascii_username[1:-1]))
-            self.assert_match((filtr, self.username[1:-1].lower()))
+            self.assert_match_ignoring_case(filtr, self.username[1:-1].lower())
             self.assert_match((filtr, self.ascii_username[1:-1].lower()))
-            self.assert_match((filtr, self.username[1:-1].upper()))
+            self.assert_match_ignoring_case(filtr, self.username[1:-1].upper())
             self.assert_match((filtr, self.ascii_username[1:-1].upper()))
             self.assert_no_match((filtr, self.nomatch))
 
@@ -111,9 +158,9 @@ class UnaccentTestCase(TestCase):
         for filtr in ('username__istartswith_unaccent', 'username__istartswith_unaccent_smart'):
             self.assert_match((filtr, self.username[:-1]))
             self.assert_match((filtr, self.ascii_username[:-1]))
-            self.assert_match((filtr, self.username[:-1].lower()))
+            self.assert_match_ignoring_case(filtr, self.username[:-1].lower())
             self.assert_match((filtr, self.ascii_username[:-1].lower()))
-            self.assert_match((filtr, self.username[:-1].upper()))
+            self.assert_match_ignoring_case(filtr, self.username[:-1].upper())
             self.assert_match((filtr, self.ascii_username[:-1].upper()))
             self.assert_no_match((filtr, self.username[1:]))
             self.assert_no_match((filtr, self.ascii_username[1:]))
@@ -139,9 +186,9 @@ class UnaccentTestCase(TestCase):
         for filtr in ('username__iendswith_unaccent', 'username__iendswith_unaccent_smart'):
             self.assert_match((filtr, self.username[1:]))
             self.assert_match((filtr, self.ascii_username[1:]))
-            self.assert_match((filtr, self.username[1:].lower()))
+            self.assert_match_ignoring_case(filtr, self.username[1:].lower())
             self.assert_match((filtr, self.ascii_username[1:].lower()))
-            self.assert_match((filtr, self.username[1:].upper()))
+            self.assert_match_ignoring_case(filtr, self.username[1:].upper())
             self.assert_match((filtr, self.ascii_username[1:].upper()))
             self.assert_no_match((filtr, self.username[:-1]))
             self.assert_no_match((filtr, self.ascii_username[:-1]))
@@ -150,9 +197,951 @@ class UnaccentTestCase(TestCase):
         self.assert_match(('username__iendswith_unaccent', username_with_missing_accent))
         self.assert_no_match(('username__iendswith_unaccent_smart', username_with_missing_accent))
 
+    def test_in_unaccent(self):
+
+        for filtr in ('username__in_unaccent', 'username__in_unaccent_smart'):
+            self.assert_match((filtr, [self.nomatch, self.username]))
+            self.assert_match((filtr, [self.nomatch, self.ascii_username]))
+            self.assertTrue(User.objects.filter(**{filtr: (name for name in [self.ascii_username])}).exists())
+            self.assert_no_match((filtr, [self.nomatch, self.username[1:], self.ascii_username.upper()]))
+            self.assert_no_match((filtr, []))
+
+        username_with_missing_accent = u"Ôtaèkù"
+        self.assert_match(('username__in_unaccent', [self.nomatch, username_with_missing_accent]))
+        self.assert_no_match(('username__in_unaccent_smart', [self.nomatch, username_with_missing_accent]))
+
+    def test_iin_unaccent(self):
+
+        for filtr in ('username__iin_unaccent', 'username__iin_unaccent_smart'):
+            self.assert_match((filtr, [self.nomatch, self.ascii_username.lower()]))
+            self.assert_match((filtr, [self.ascii_username.upper()]))
+            self.assert_no_match((filtr, [self.nomatch, self.username[1:]]))
+            self.assert_no_match((filtr, []))
+        self.assert_match(('username__iin_unaccent', [self.nomatch, self.username.lower()]))
+        if connection.vendor != 'sqlite':
+            # As Django's, SQLite's UPPER only folds the case of ascii chars
+            self.assert_match(('username__iin_unaccent_smart', [self.nomatch, self.username.lower()]))
+
+        username_with_missing_accent = u"Ôtaèkù".upper()
+        self.assert_match(('username__iin_unaccent', [self.nomatch, username_with_missing_accent]))
+        self.assert_no_match(('username__iin_unaccent_smart', [self.nomatch, username_with_missing_accent]))
+
+    def test_in_unaccent_single_parameter(self):
+        terms = [u"Ôtâèkù", u"Élodie", u"Zoë", u"Jérôme", u"Élodie"]
+        queryset = User.objects.filter(username__iin_unaccent=terms)
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        if connection.vendor == 'postgresql':
+            self.assertIn('= ANY(%s)', sql)
+            self.assertEqual(len(params), 1)
+            self.assertEqual(sorted(params[0]), [u"ELODIE", u"JEROME", u"OTAEKU", u"ZOE"])
+        else:
+            self.assertEqual(sorted(params), [u"ELODIE", u"JEROME", u"OTAEKU", u"ZOE"])
+
+    def test_in_unaccent_none(self):
+        for lookup_type in ('in_unaccent', 'iin_unaccent', 'in_unaccent_smart', 'iin_unaccent_smart'):
+            self.assert_match(**{'username__' + lookup_type: [None, self.swap_username()]})
+            self.assert_no_match(**{'username__' + lookup_type: [None]})
+
+    def test_in_unaccent_invalid_values(self):
+        subquery = User.objects.values_list('username', flat=True)
+        self.assertRaises(ValueError, User.objects.filter, username__iin_unaccent=subquery)
+        self.assertRaises(ValueError, User.objects.filter, username__iunaccent=F('first_name'))
+        self.assertRaises(ValueError, User.objects.filter, username__iin_unaccent=u"otaeku")
+        # Generators are consumed once
+        queryset = User.objects.filter(username__iin_unaccent=(term for term in [u"otaeku"]))
+        self.assertEqual(queryset.count(), 1)
+        self.assertEqual(queryset.count(), 1)
+
+
+def explain(queryset):
+    cursor = connection.cursor()
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    cursor.execute('EXPLAIN ' + sql, params)
+    return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+@override_settings(UNACCENT_NORMALIZE_TERMS=True)
+class UnaccentNormalizedTermsTestCase(UnaccentTestCase):
+    """Runs the operators tests with the search terms normalized in Python"""
+
+    def test_search_terms_are_plain_parameters(self):
+        for lookup_type, term, param in (
+                ('unaccent', u"Ôtâèkù", u"Otaeku"),
+                ('iunaccent', u"ôtâèkù", u"OTAEKU"),
+                ('icontains_unaccent', u"âèk", u"%AEK%"),
+                ('startswith_unaccent', u"Ôt", u"Ot%")):
+            queryset = User.objects.filter(**{'username__' + lookup_type: term})
+            sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+            self.assertNotIn('unaccent(%s)', sql)
+            self.assertEqual(params, (param,))
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Expression indexes require PostgreSQL')
+class UnaccentIndexTestCase(TestCase):
+
+    def setUp(self):
+        call_command('unaccent_indexes', 'auth.User.username')
+        User(username=u"Ôtâèkù").save()
+
+        cursor = connection.cursor()
+        cursor.execute('ANALYZE auth_user')
+        # The table is too small for the planner to prefer an index on its own
+        cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_lookups_use_expression_indexes(self):
+        field = User._meta.get_field('username')
+
+        with override_settings(UNACCENT_FUNCTION=UnaccentOperation.immutable_function):
+            for suffix, lookup_type, method, opclass in INDEX_VARIANTS:
+                queryset = User.objects.filter(**{'username__' + lookup_type: u"Otaeku"})
+                self.assertTrue(queryset.exists())
+                # text_pattern_ops indexes also serve equality, either one may be picked by the planner
+                self.assertIn(index_name(User, field, suffix.replace('_like', '')), explain(queryset))
+
+
+class UnaccentIndexSqlTestCase(unittest.TestCase):
+
+    def test_immutable_function_sql(self):
+        # The wrapper must not depend on the search_path
+        self.assertIn('SELECT "public".unaccent(\'"public".unaccent\'::regdictionary, $1)',
+                      immutable_function_sql(connection=connection))
+        self.assertIn('SELECT "extensions".unaccent(\'"extensions".unaccent\'::regdictionary, $1)',
+                      immutable_function_sql(schema='extensions', connection=connection))
+
+    def test_drop_every_variant(self):
+        out = StringIO()
+        call_command('unaccent_indexes', 'auth.User.username', drop=True, pattern_ops=False, print_sql=True, stdout=out)
+        statements = out.getvalue().split(';\n')[:-1]
+        field = User._meta.get_field('username')
+        variants = INDEX_VARIANTS + TRIGRAM_INDEX_VARIANTS + KEYSET_INDEX_VARIANTS
+        names = [index_name(User, field, suffix) for suffix, lookup_type, method, opclass in variants]
+        self.assertEqual(statements, ['DROP INDEX IF EXISTS %s' % connection.ops.quote_name(name) for name in names])
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Trigram indexes require PostgreSQL')
+class UnaccentTrigramIndexTestCase(TestCase):
+
+    def setUp(self):
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if not cursor.fetchone():
+            self.skipTest('pg_trgm is not available')
+
+        call_command('unaccent_indexes', 'auth.User.username', trigram=True, pattern_ops=False)
+
+        # Seed the table so that the statistics are meaningful
+        User.objects.bulk_create([User(username=u"user%05d" % i) for i in xrange(2000)])
+        User(username=u"Ôtâèkù").save()
+
+        cursor.execute('ANALYZE auth_user')
+        cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_lookups_use_trigram_indexes(self):
+        field = User._meta.get_field('username')
+        expected_indexes = {
+            'contains_unaccent': 'unaccent_trgm',
+            'endswith_unaccent': 'unaccent_trgm',
+            'icontains_unaccent': 'iunaccent_trgm',
+            'iendswith_unaccent': 'iunaccent_trgm',
+        }
+
+        with override_settings(UNACCENT_FUNCTION=UnaccentOperation.immutable_function):
+            for lookup_type, suffix in expected_indexes.items():
+                queryset = User.objects.filter(**{'username__' + lookup_type: u"aeku"})
+                self.assertTrue(queryset.exists())
+                self.assertIn(index_name(User, field, suffix), explain(queryset))
+
+    def test_concat_filter_uses_trigram_index(self):
+        fields = [User._meta.get_field(name) for name in ('username', 'first_name', 'last_name')]
+        cursor = connection.cursor()
+        for name, sql in concat_index_sql(User, fields, connection, trigram=True):
+            cursor.execute(sql)
+        cursor.execute('ANALYZE auth_user')
+
+        with override_settings(UNACCENT_FUNCTION=UnaccentOperation.immutable_function):
+            queryset = concat_filter(User.objects.all(), ['username', 'first_name', 'last_name'],
+                                     'icontains_unaccent', u"aeku")
+            self.assertTrue(queryset.exists())
+            self.assertIn('auth_user_username_first_name_last_name_iunaccent_trgm', explain(queryset))
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Nondeterministic collations require PostgreSQL')
+class UnaccentCollationTestCase(TestCase):
+
+    def setUp(self):
+        cursor = connection.cursor()
+        cursor.execute("SELECT current_setting('server_version_num')::int >= 120000 "
+                       "AND EXISTS (SELECT 1 FROM pg_collation WHERE collprovider = 'i')")
+        if not cursor.fetchone()[0]:
+            self.skipTest('Nondeterministic ICU collations require PostgreSQL >= 12 built with ICU')
+
+        call_command('unaccent_collations', 'auth.User.username')
+        User(username=u"Ôtâèkù").save()
+        cursor.execute('ANALYZE auth_user')
+        cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_collations(self):
+        field = User._meta.get_field('username')
+
+        with override_settings(UNACCENT_USE_COLLATIONS=True):
+            for lookup_type, term, suffix in (
+                    ('unaccent', u"Otaeku", 'unaccent_coll'),
+                    ('iunaccent', u"OTAÉKU", 'iunaccent_coll'),
+                    ('iin_unaccent', [u"zzz", u"otaeku"], 'iunaccent_coll')):
+                queryset = User.objects.filter(**{'username__' + lookup_type: term})
+                sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+                self.assertIn('COLLATE', sql)
+                self.assertNotIn('unaccent(', sql)
+                self.assertTrue(queryset.exists())
+                self.assertIn(index_name(User, field, suffix), explain(queryset))
+
+            self.assertFalse(User.objects.filter(username__unaccent=u"OTAEKU").exists())
+            # LIKE can not use the collations
+            queryset = User.objects.filter(username__icontains_unaccent=u"tae")
+            self.assertNotIn('COLLATE', queryset.query.get_compiler(queryset.db).as_sql()[0])
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Full text search requires PostgreSQL')
+class UnaccentTextSearchTestCase(TestCase):
+
+    def setUp(self):
+        call_command('unaccent_text_search', 'auth.User.first_name')
+        User.objects.bulk_create([User(username=u"user%05d" % i, first_name=u"user %05d" % i) for i in xrange(2000)])
+        self.user = User.objects.create(username=u"jd", first_name=u"Jérôme Dupré")
+
+        cursor = connection.cursor()
+        cursor.execute('ANALYZE auth_user')
+        cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_search_unaccent(self):
+        for filtr in ('first_name__search_unaccent', 'first_name__search_unaccent_smart'):
+            self.assertEqual(list(User.objects.filter(**{filtr: u"dupre jerome"})), [self.user])
+            self.assertEqual(list(User.objects.filter(**{filtr: u"jerome martin"})), [])
+
+        self.assertEqual(list(User.objects.filter(first_name__search_unaccent=u"Dupre Jérome")), [self.user])
+        # Accents are significant to the smart lookup when given
+        self.assertEqual(list(User.objects.filter(first_name__search_unaccent_smart=u"Dupré Jérôme")), [self.user])
+        self.assertEqual(list(User.objects.filter(first_name__search_unaccent_smart=u"Dupre Jérome")), [])
+
+    def test_gin_index(self):
+        queryset = User.objects.filter(first_name__search_unaccent=u"dupre")
+        self.assertIn(index_name(User, User._meta.get_field('first_name'), 'unaccent_tsv'), explain(queryset))
+
+
+class UnaccentCheckIndexesTestCase(TestCase):
+
+    def check_indexes(self, *labels, **options):
+        """Returns whether the command succeeded, and its output"""
+        stdout = StringIO()
+        try:
+            # Command errors exit with a non-zero status
+            call_command('unaccent_check_indexes', *labels, stdout=stdout, stderr=StringIO(), **options)
+        except SystemExit:
+            return False, stdout.getvalue()
+        return True, stdout.getvalue()
+
+    def test_seq_scans(self):
+        ok, output = self.check_indexes('auth.User.username', 'auth.User.first_name+last_name',
+                                        lookups=['iunaccent', 'unaccent'])
+        self.assertFalse(ok)
+        self.assertIn('UNINDEXED auth.User.username__iunaccent', output)
+        self.assertIn('UNINDEXED auth.User.username__unaccent', output)
+        self.assertIn('UNINDEXED auth.User.first_name+last_name__iunaccent', output)
+        # The case sensitive lookups are not applied to concatenations
+        self.assertNotIn('first_name+last_name__unaccent', output)
+
+        ok, output = self.check_indexes('auth.User.username', lookups=['unknown'])
+        self.assertFalse(ok)
+
+    def test_postgresql_filter_scans(self):
+        class Cursor(object):
+            def __init__(self, plan):
+                self.plan = plan
+
+            def execute(self, sql, params):
+                pass
+
+            def fetchone(self):
+                return [[{'Plan': self.plan}]]
+
+        # The lookup is applied as a Filter of a full scan of the primary key
+        plan = {'Node Type': 'Index Scan', 'Relation Name': 'auth_user', 'Index Name': 'auth_user_pkey',
+                'Plan Rows': 5, 'Filter': "(upper(f_unaccent((username)::text)) = 'OTAEKU'::text)"}
+        self.assertEqual(postgresql_unindexed_scans(Cursor(plan), 'SELECT', (), ['username']),
+                         [('Index Scan using auth_user_pkey on auth_user', 5)])
+
+        plan = {'Node Type': 'Bitmap Heap Scan', 'Relation Name': 'auth_user', 'Plan Rows': 5,
+                'Recheck Cond': "(upper(f_unaccent((username)::text)) = 'OTAEKU'::text)",
+                'Plans': [{'Node Type': 'Bitmap Index Scan', 'Index Name': 'auth_user_username_iunaccent',
+                           'Index Cond': "(upper(f_unaccent((username)::text)) = 'OTAEKU'::text)"}]}
+        self.assertEqual(postgresql_unindexed_scans(Cursor(plan), 'SELECT', (), ['username']), [])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Expression indexes require PostgreSQL')
+    def test_indexes(self):
+        call_command('unaccent_indexes', 'auth.User.username')
+        with override_settings(UNACCENT_FUNCTION=UnaccentOperation.immutable_function):
+            ok, output = self.check_indexes('auth.User.username', lookups=['unaccent', 'iunaccent', 'in_unaccent',
+                                                                           'istartswith_unaccent'])
+        self.assertTrue(ok, output)
+        self.assertIn('OK auth.User.username__iunaccent', output)
+
+
+class UnaccentConcatFilterTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username=u"jmuller", first_name=u"Jérôme", last_name=u"Müller")
+        User.objects.create(username=u"otaeku")
+        self.fields = ['username', 'first_name', 'last_name']
+
+    def search(self, lookup_type, value, queryset=None):
+        return list(concat_filter(queryset or User.objects.all(), self.fields, lookup_type, value))
+
+    def test_concat_filter(self):
+        self.assertEqual(self.search('icontains_unaccent', u"jerome"), [self.user])
+        self.assertEqual(self.search('icontains_unaccent', u"MÜLL"), [self.user])
+        self.assertEqual(self.search('icontains_unaccent', u"Jérôme Muller"), [self.user])
+        self.assertEqual(self.search('iunaccent', u"JMULLER JEROME MULLER"), [self.user])
+        self.assertEqual(self.search('istartswith_unaccent', u"jmu"), [self.user])
+        self.assertEqual(self.search('icontains_unaccent', u"zzz"), [])
+        self.assertEqual(self.search('icontains_unaccent', u"jerome", User.objects.filter(username=u"otaeku")), [])
+        self.assertRaises(ValueError, self.search, 'icontains_unaccent_smart', u"jerome")
+
+    def test_single_unaccent_call(self):
+        queryset = concat_filter(User.objects.all(), self.fields, 'icontains_unaccent', u"jerome")
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        self.assertEqual(sql.count('unaccent('), 2)  # The column side and the search term
+        self.assertEqual(params, (u"%jerome%",))
+
+
+def find_unaccent_node(where):
+    for child in where.children:
+        if isinstance(child, UnaccentNode):
+            return child
+        if hasattr(child, 'children'):
+            node = find_unaccent_node(child)
+            if node is not None:
+                return node
+    return None
+
+
+class UnaccentNodeTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username=u"Ôtâèkù")
+        self.user.groups.add(Group.objects.create(name=u"Équipe"))
+
+    def test_pickle(self):
+        for queryset in (User.objects.filter(username__iunaccent=u"otaeku"),
+                         User.objects.filter(username__in_unaccent_smart=[u"Otaeku", u"Élodie"]),
+                         concat_filter(User.objects.all(), ['username', 'email'], 'icontains_unaccent', u"taek")):
+            unpickled = User.objects.all()
+            unpickled.query = pickle.loads(pickle.dumps(queryset.query, pickle.HIGHEST_PROTOCOL))
+            self.assertEqual(list(unpickled), [self.user])
+
+    def test_clone(self):
+        queryset = User.objects.filter(username__iunaccent=u"otaeku")
+        node = find_unaccent_node(queryset.query.where)
+        clone = find_unaccent_node(queryset._clone().query.where)
+        self.assertIsNot(clone, node)
+        self.assertIs(clone.field, node.field)
+
+        clone.relabel_aliases({'auth_user': 'T9'})
+        self.assertEqual(clone.table_alias, 'T9')
+        self.assertEqual(node.table_alias, 'auth_user')
+        self.assertEqual(copy.deepcopy(node).table_alias, 'auth_user')
+
+    def test_combine(self):
+        queryset = (User.objects.filter(groups__name__iunaccent=u"equipe") |
+                    User.objects.filter(groups__name__iunaccent=u"other", username__iunaccent=u"otaeku"))
+        self.assertEqual(list(queryset.distinct()), [self.user])
+        self.assertEqual(list(User.objects.exclude(groups__name__iunaccent=u"equipe")), [])
+
+
+class UnaccentShadowFieldTestCase(TestCase):
+
+    def setUp(self):
+        self.person = Person.objects.create(name=u"Ôtâèkù")
+
+    def assert_shadows(self, name):
+        person = Person.objects.get(name=name)
+        self.assertEqual(person.name_unaccent, u"Otaeku")
+        self.assertEqual(person.name_iunaccent, u"OTAEKU")
+
+    def test_save(self):
+        self.assert_shadows(u"Ôtâèkù")
+
+        self.person.name = u"Ôtâèkù!"
+        self.person.save()
+        self.assertEqual(Person.objects.get(pk=self.person.pk).name_iunaccent, u"OTAEKU!")
+
+    def test_bulk_create(self):
+        Person.objects.bulk_create([Person(name=u"Èlèvé")])
+        self.assertEqual(Person.objects.get(name=u"Èlèvé").name_iunaccent, u"ELEVE")
+
+    def test_update(self):
+        Person.objects.filter(pk=self.person.pk).update(name=u"Èlèvé")
+        self.assertEqual(Person.objects.get(pk=self.person.pk).name_iunaccent, u"ELEVE")
+
+        Person.objects.filter(pk=self.person.pk).update(name=F('name_unaccent'))
+        self.assertEqual(Person.objects.get(pk=self.person.pk).name_iunaccent, u"ELEVE")
+
+    def test_backfill(self):
+        Person.objects.update(name_unaccent=None, name_iunaccent=None)
+        call_command('unaccent_backfill', 'django_unaccent.Person', batch_size=1, verbosity=0)
+        self.assert_shadows(u"Ôtâèkù")
+
+    def test_lookups_use_shadow_columns(self):
+        for lookup_type, term, column in (
+                ('unaccent', u"Otaeku", 'name_unaccent'),
+                ('iunaccent', u"otaekù", 'name_iunaccent'),
+                ('contains_unaccent', u"tae", 'name_unaccent'),
+                ('icontains_unaccent', u"TÂE", 'name_iunaccent'),
+                ('istartswith_unaccent', u"ôta", 'name_iunaccent'),
+                ('iendswith_unaccent', u"EKU", 'name_iunaccent')):
+            queryset = Person.objects.filter(**{'name__' + lookup_type: term})
+            sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+            self.assertIn(connection.ops.quote_name(column), sql)
+            self.assertNotIn('unaccent(', sql)
+            self.assertEqual(list(queryset), [self.person])
+
+        if connection.vendor != 'sqlite':
+            # SQLite's LIKE is case insensitive
+            self.assertFalse(Person.objects.filter(name__contains_unaccent=u"TAE").exists())
+
+    def test_characters_without_rule(self):
+        # Kept as by the unaccent function of the database, not removed
+        moscow = Person.objects.create(name=u"Москва")
+        Person.objects.create(name=u"東京")
+        self.assertEqual(Person.objects.get(pk=moscow.pk).name_unaccent, u"Москва")
+        self.assertEqual(list(Person.objects.filter(name__icontains_unaccent=u"Москва")), [moscow])
+        self.assertEqual(list(Person.objects.filter(name__iunaccent=u"東京").exclude(name=u"東京")), [])
+
+    def test_max_length(self):
+        self.assertEqual(Person._meta.get_field('name_iunaccent').max_length, 100)
+        self.assertEqual(Person._meta.get_field('name_iunaccent').get_internal_type(), 'CharField')
+        # Unbounded as its TextField source
+        field = Note._meta.get_field('text_iunaccent')
+        self.assertIsNone(field.max_length)
+        self.assertEqual(field.db_type(connection), Note._meta.get_field('text').db_type(connection))
+        note = Note.objects.create(text=u"Ôtâèkù " * 100)
+        self.assertEqual(Note.objects.get(pk=note.pk).text_iunaccent, u"OTAEKU " * 100)
+
+
+class UnaccentPrefixIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.otaeku = Person.objects.create(name=u"Ôtâèkù")
+        self.otto = Person.objects.create(name=u"otto")
+        self.elodie = Person.objects.create(name=u"Élodie")
+        self.index = register_prefix_index(Person, 'name')
+
+    def tearDown(self):
+        unregister_prefix_index(Person, 'name')
+
+    def assert_search(self, prefix, people):
+        self.assertEqual(self.index.search(prefix), [person.pk for person in people])
+        # Same result as the database
+        self.assertEqual(sorted(Person.objects.filter(name__istartswith_unaccent=prefix).values_list('pk', flat=True)),
+                         sorted(person.pk for person in people))
+
+    def test_search(self):
+        self.assert_search(u"ôt", [self.otaeku, self.otto])
+        self.assert_search(u"OTA", [self.otaeku])
+        self.assert_search(u"elo", [self.elodie])
+        self.assert_search(u"z", [])
+        self.assertEqual(self.index.search(u"o", limit=1), [self.otaeku.pk])
+        self.assertEqual(list(self.index.filter(Person.objects.all(), u"Ôtâ")), [self.otaeku])
+
+    def test_signals(self):
+        self.index.search(u"o")
+
+        self.otto.name = u"Éloïse"
+        self.otto.save()
+        zoe = Person.objects.create(name=u"Zoë")
+        self.elodie.delete()
+        self.assert_search(u"ot", [self.otaeku])
+        self.assert_search(u"el", [self.otto])
+        self.assert_search(u"zoe", [zoe])
+
+        # Changes which do not send signals need an invalidation
+        Person.objects.filter(pk=zoe.pk).update(name=u"Ötzi")
+        self.index.invalidate()
+        self.assert_search(u"ot", [self.otaeku, zoe])
+
+    def test_characters_without_rule(self):
+        # Kept as by the unaccent function of the database, not removed
+        moscow = Person.objects.create(name=u"Москва")
+        self.assert_search(u"Мос", [moscow])
+        self.assertEqual(self.index.search(u""), [])
+        self.assertEqual(self.index.search(None), [])
+
+    def test_read_replica(self):
+        # Reads go to a replica of the default database, writes to the default database
+        class ReplicaRouter(object):
+            def db_for_read(self, model, **hints):
+                return 'replica'
+
+            def db_for_write(self, model, **hints):
+                return 'default'
+
+        connections.databases['replica'] = connections.databases['default']
+        setattr(connections._connections, 'replica', connection)
+        router.routers.insert(0, ReplicaRouter())
+        try:
+            index = UnaccentPrefixIndex(Person, 'name')
+            post_save.connect(index.post_save, sender=Person, weak=False, dispatch_uid='test_read_replica')
+            self.assertEqual(index.using, 'replica')
+            self.assertEqual(index.search(u"ot"), [self.otaeku.pk, self.otto.pk])
+
+            self.otto.name = u"Éloïse"
+            self.otto.save()
+            self.assertEqual(index.search(u"ot"), [self.otaeku.pk])
+        finally:
+            post_save.disconnect(sender=Person, dispatch_uid='test_read_replica')
+            router.routers.pop(0)
+            delattr(connections._connections, 'replica')
+            del connections.databases['replica']
+
+
+class UnaccentResultCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username=u"Ôtâèkù")
+        self.result_cache = UnaccentResultCache(timeout=60)
+        self.result_cache.cache.clear()
+
+    def assert_stats(self, hits, misses):
+        stats = self.result_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (hits, misses))
+
+    def test_search(self):
+        search = self.result_cache.search
+        self.assertEqual(search(User, 'username', 'iunaccent', u"otaeku"), [self.user.pk])
+        self.assert_stats(0, 1)
+        # Accent and case variants share the entry
+        self.assertEqual(search(User, 'username', 'iunaccent', u"ÔTÂÈKÙ"), [self.user.pk])
+        self.assertEqual(search(User, 'username', 'iunaccent', u"Otâeku"), [self.user.pk])
+        self.assert_stats(2, 1)
+        self.assertEqual(search(User, 'username', 'icontains_unaccent', u"tae"), [self.user.pk])
+        self.assert_stats(2, 2)
+
+        queryset = self.result_cache.filter(User.objects.all(), 'username', 'iunaccent', u"OTAEKU")
+        self.assertEqual(list(queryset), [self.user])
+        self.assert_stats(3, 2)
+
+        self.assertRaises(ValueError, search, User, 'username', 'iunaccent_smart', u"otaeku")
+
+    def test_invalidation(self):
+        search = self.result_cache.search
+        search(User, 'username', 'iunaccent', u"otaeku")
+
+        other = User.objects.create(username=u"otaeku")
+        self.assertEqual(sorted(search(User, 'username', 'iunaccent', u"otaeku")), [self.user.pk, other.pk])
+        other.delete()
+        self.assertEqual(search(User, 'username', 'iunaccent', u"otaeku"), [self.user.pk])
+        self.assert_stats(0, 3)
+
+        # update() does not send signals
+        User.objects.filter(pk=self.user.pk).update(username=u"Élodie")
+        self.assertEqual(search(User, 'username', 'iunaccent', u"otaeku"), [self.user.pk])
+        self.result_cache.invalidate(User)
+        self.assertEqual(search(User, 'username', 'iunaccent', u"otaeku"), [])
+
+    def test_max_results(self):
+        self.result_cache.max_results = 0
+        self.result_cache.search(User, 'username', 'iunaccent', u"otaeku")
+        self.result_cache.search(User, 'username', 'iunaccent', u"otaeku")
+        self.assert_stats(0, 2)
+
+    def test_more_results_than_max_results(self):
+        User.objects.bulk_create([User(username=u"Ôtâèkù %d" % i) for i in range(19)])
+        self.result_cache.max_results = 5
+
+        pks = self.result_cache.search(User, 'username', 'icontains_unaccent', u"otaeku")
+        self.assertEqual(len(pks), 20)
+        queryset = self.result_cache.filter(User.objects.all(), 'username', 'icontains_unaccent', u"otaeku")
+        self.assertEqual(queryset.count(), 20)
+        self.assert_stats(0, 2)
+
+
+class UnaccentRulesTestCase(unittest.TestCase):
+
+    def test_unaccent(self):
+        self.assertEqual(unaccent(u"Ééüçñøà"), u"Eeucnoa")
+        # Letters without decomposition are transliterated as PostgreSQL does
+        self.assertEqual(unaccent(u"Æsøp Œuvre Straße Łódź"), u"AEsop OEuvre Strasse Lodz")
+        # Characters without rule are left untouched
+        self.assertEqual(unaccent(u"€ 東京"), u"€ 東京")
+        self.assertEqual(unaccent(u"“¼\xa0½”"), u'"1/4 1/2"')
+
+    def test_parse_rule(self):
+        # Whitespace before the replacement is skipped, as by unaccent.c
+        self.assertEqual(parse_rule(u"¼\t 1/4\n"), (u"¼", u"1/4"))
+        self.assertEqual(parse_rule(u"é e\r\n"), (u"é", u"e"))
+        self.assertEqual(parse_rule(u"\u0301\n"), (u"\u0301", u""))
+        # Quoted replacements of PostgreSQL >= 13
+        self.assertEqual(parse_rule(u'¼\t" 1/4"\n'), (u"¼", u" 1/4"))
+        self.assertEqual(parse_rule(u'\u200b\t""\n'), (u"\u200b", u""))
+        self.assertEqual(parse_rule(u'“\t""""\n'), (u"“", u'"'))
+        self.assertEqual(parse_rule(u'\xa0\t" "\n'), (u"\xa0", u" "))
+        # Blank lines and rules of more than two strings are skipped
+        self.assertIsNone(parse_rule(u" \n"))
+        self.assertIsNone(parse_rule(u"é\te e\n"))
+
+    def test_asciify(self):
+        self.assertEqual(asciify(u"Ééüçñøàæ"), "Eeucnoaae")
+        self.assertEqual(asciify(u"€ 東京"), " ")
+
+    def test_asciify_non_string(self):
+        self.assertEqual(asciify(12), "12")
+        self.assertEqual(asciify(1.5), "1.5")
+        self.assertEqual(asciify(True), "True")
+        self.assertIsNone(asciify(None))
+        self.assertFalse(has_accents(None))
+
+    def test_has_accents(self):
+        for value in (u"Otaeku", "Otaeku", u"", u"a-z 0.9"):
+            self.assertFalse(has_accents(value))
+            self.assertEqual(asciify(value), value)
+        for value in (u"Ôtâèkù", u"Otaekù", u"€", u"Œ"):
+            self.assertTrue(has_accents(value))
+            self.assertNotEqual(asciify(value), value)
+
+    def test_asciify_many(self):
+        values = [u"Ôtâèkù", None, u"Zoë", u"Ôtâèkù", "Smith"]
+        self.assertEqual(list(asciify_many(values)), ["Otaeku", None, "Zoe", "Otaeku", "Smith"])
+        self.assertEqual(list(asciify_many(iter(values), cache_size=2)), ["Otaeku", None, "Zoe", "Otaeku", "Smith"])
+
+    def test_database_parity(self):
+        cursor = connection.cursor()
+        terms = [u"Ééüçñøà", u"Æsøp Œuvre Straße Łódź", u"Ôtâèkù"]
+        for term in terms:
+            cursor.execute('SELECT unaccent(%s)', [term])
+            self.assertEqual(cursor.fetchone()[0], unaccent(term))
+
+
+class UnaccentMetricsTestCase(TestCase):
+
+    def setUp(self):
+        User(username=u"Ôtâèkù").save()
+        metrics.reset()
+        enable_instrumentation()
+
+    def tearDown(self):
+        disable_instrumentation()
+
+    def test_metrics(self):
+        self.assertTrue(User.objects.filter(username__icontains_unaccent=u"tae").exists())
+        self.assertTrue(User.objects.filter(username__icontains_unaccent_smart=u"tâè").exists())
+        self.assertTrue(User.objects.filter(username__iunaccent=u"otaeku").exists())
+        self.assertTrue(User.objects.filter(username__contains=u"kù").exists())
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['lookups'], {'icontains_unaccent': 1, 'iunaccent': 1})
+        self.assertEqual(snapshot['fallbacks'], {'icontains_unaccent_smart': 1})
+        self.assertEqual(sorted(snapshot['durations']), ['icontains_unaccent', 'iunaccent'])
+        self.assertEqual(snapshot['durations']['iunaccent']['count'], 1)
+        self.assertEqual(sum(snapshot['durations']['iunaccent']['histogram']), 1)
+
+    def test_slow_query(self):
+        reports = []
+
+        def receiver(sender, **kwargs):
+            reports.append(kwargs)
+        unaccent_slow_query.connect(receiver)
+
+        try:
+            with override_settings(UNACCENT_SLOW_QUERY_THRESHOLD=0, UNACCENT_EXPLAIN_SLOW_QUERIES=True):
+                list(User.objects.filter(username__iunaccent=u"otaeku"))
+                list(User.objects.filter(username__iexact=u"otaeku"))
+        finally:
+            unaccent_slow_query.disconnect(receiver)
+
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]['lookup_types'], set(['iunaccent']))
+        self.assertEqual(reports[0]['plan'] is not None, connection.vendor == 'postgresql')
+
+    def test_failed_query(self):
+        queryset = User.objects.filter(username__iunaccent=u"otaeku").extra(where=['no_such_column = 1'])
+        with override_settings(UNACCENT_SLOW_QUERY_THRESHOLD=0, UNACCENT_EXPLAIN_SLOW_QUERIES=True):
+            # The error of the query is raised, not one of the instrumentation
+            self.assertRaises(DatabaseError, list, queryset)
+        self.assertEqual(metrics.snapshot()['durations'], {})
+
+    def test_explain_failure(self):
+        reports = []
+
+        def receiver(sender, **kwargs):
+            reports.append(kwargs)
+
+        def explain(compiler, sql, params):
+            raise DatabaseError('explain failed')
+
+        unaccent_slow_query.connect(receiver)
+        original_explain, metrics_module.explain = metrics_module.explain, explain
+        try:
+            with override_settings(UNACCENT_SLOW_QUERY_THRESHOLD=0):
+                self.assertEqual(len(list(User.objects.filter(username__iunaccent=u"otaeku"))), 1)
+        finally:
+            metrics_module.explain = original_explain
+            unaccent_slow_query.disconnect(receiver)
+
+        self.assertEqual(len(reports), 1)
+        self.assertIsNone(reports[0]['plan'])
+
+
+class UnaccentPlannerTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username=u"Ôtâèkù")
+        self.field = User._meta.get_field('username')
+        connection.__dict__.pop('unaccent_column_stats', None)
+        enable_adaptive_planner()
+
+    def tearDown(self):
+        disable_adaptive_planner()
+
+    def test_fallback(self):
+        decision = planner.plan(self.field, 'icontains_unaccent_smart', u"tâè")
+        self.assertEqual((decision.strategy, decision.accepted, decision.lookup_type),
+                         ('fallback', False, 'icontains'))
+        self.assertEqual(list(User.objects.filter(username__icontains_unaccent_smart=u"tâè")), [self.user])
+
+    def test_ascii_field(self):
+        self.assertEqual(planner.plan(self.field, 'iunaccent_smart', u"otaeku").strategy, 'unaccent')
+        with override_settings(UNACCENT_ASCII_FIELDS=['auth.User.username']):
+            decision = planner.plan(self.field, 'unaccent_smart', u"otaeku")
+            self.assertEqual((decision.strategy, decision.accepted, decision.lookup_type), ('ascii', False, 'exact'))
+            decision = planner.plan(self.field, 'startswith_unaccent_smart', u"ota")
+            self.assertEqual((decision.strategy, decision.accepted, decision.lookup_type),
+                             ('ascii', False, 'startswith'))
+
+            queryset = User.objects.filter(username__unaccent_smart=u"Otaeku")
+            self.assertIsNone(find_unaccent_node(queryset.query.where))
+            self.assertEqual(list(queryset), [])
+
+            # No plain index serves UPPER(column) nor LIKE '%term%': the expression indexes are kept
+            for lookup_type in ('iunaccent_smart', 'istartswith_unaccent_smart', 'contains_unaccent_smart',
+                                'icontains_unaccent_smart', 'iendswith_unaccent_smart'):
+                self.assertNotEqual(planner.plan(self.field, lookup_type, u"otaeku").strategy, 'ascii')
+            self.assertEqual(list(User.objects.filter(username__iunaccent_smart=u"otaeku")), [self.user])
+            # Lookups which are not smart are not planned
+            self.assertEqual(list(User.objects.filter(username__iunaccent=u"otaeku")), [self.user])
+
+        with override_settings(UNACCENT_ASCII_FIELDS=['auth.User.first_name+last_name']):
+            self.assertRaises(ImproperlyConfigured, planner.plan, self.field, 'iunaccent_smart', u"otaeku")
+
+    def test_without_immutable_function(self):
+        # Without the wrapper there is no expression index to avoid: the SQL is that of the default mode
+        decision = planner.plan(self.field, 'icontains_unaccent_smart', u"ta")
+        self.assertEqual((decision.strategy, decision.function), ('unaccent', None))
+
+        queryset = User.objects.filter(username__icontains_unaccent_smart=u"ta")
+        disable_adaptive_planner()
+        default = User.objects.filter(username__icontains_unaccent_smart=u"ta")
+        self.assertEqual(queryset.query.get_compiler(using='default').as_sql(),
+                         default.query.get_compiler(using='default').as_sql())
+
+    def test_adaptive(self):
+        with override_settings(UNACCENT_FUNCTION=UnaccentOperation.immutable_function):
+            # The statistics are only read when rendering, on the connection of the query
+            self.assertEqual(planner.plan(self.field, 'icontains_unaccent_smart', u"tae").strategy, 'adaptive')
+            with self.assertNumQueries(0):
+                queryset = User.objects.filter(username__icontains_unaccent_smart=u"tae")
+            self.assertTrue(find_unaccent_node(queryset.query.where).adaptive)
+            self.assertEqual(list(queryset), [self.user])
+
+            decision = planner.plan(self.field, 'icontains_unaccent_smart', u"tae", connection)
+            self.assertIn(decision.strategy, ('unaccent', 'unindexed'))
+            if connection.vendor != 'postgresql':
+                self.assertEqual(decision.reason, 'selectivity unknown')
+
+    def test_short_term(self):
+        with override_settings(UNACCENT_FUNCTION=UnaccentOperation.immutable_function):
+            decision = planner.plan(self.field, 'icontains_unaccent_smart', u"ta")
+            self.assertEqual((decision.strategy, decision.function), ('unindexed', 'unaccent'))
+            # A prefix is served by a btree index whatever its length
+            self.assertNotEqual(planner.plan(self.field, 'istartswith_unaccent_smart', u"o").strategy, 'unindexed')
+
+            queryset = User.objects.filter(username__icontains_unaccent_smart=u"ta")
+            self.assertEqual(find_unaccent_node(queryset.query.where).function, 'unaccent')
+            sql, params = queryset.query.get_compiler(using='default').as_sql()
+            self.assertIn('UPPER(unaccent(', sql)
+            self.assertNotIn(UnaccentOperation.immutable_function, sql)
+            self.assertEqual(list(queryset), [self.user])
+
+            queryset = User.objects.filter(username__icontains_unaccent_smart=u"tae")
+            self.assertIsNone(find_unaccent_node(queryset.query.where).function)
+            self.assertEqual(list(queryset), [self.user])
+
+    @override_settings(UNACCENT_FUNCTION=UnaccentOperation.immutable_function)
+    def test_signal(self):
+        decisions = []
+
+        def receiver(sender, **kwargs):
+            decisions.append((kwargs['lookup_type'], kwargs['decision'].strategy))
+        unaccent_planned.connect(receiver)
+
+        try:
+            User.objects.filter(username__icontains_unaccent_smart=u"tâè")
+            User.objects.filter(username__icontains_unaccent_smart=u"ta")
+            User.objects.filter(username__icontains_unaccent=u"ta")
+        finally:
+            unaccent_planned.disconnect(receiver)
+
+        self.assertEqual(decisions, [('icontains_unaccent_smart', 'fallback'),
+                                     ('icontains_unaccent_smart', 'unindexed')])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'pg_stats is specific to PostgreSQL')
+    def test_selectivity(self):
+        # Unique columns have no most common values
+        Person.objects.bulk_create([Person(name=u"Élodie") for i in range(100)] +
+                                   [Person(name=u"person %d" % i) for i in range(100)])
+        connection.cursor().execute('ANALYZE %s' % Person._meta.db_table)
+        field = Person._meta.get_field('name')
+
+        with override_settings(UNACCENT_FUNCTION=UnaccentOperation.immutable_function):
+            decision = planner.plan(field, 'icontains_unaccent_smart', u"elo", connection)
+            self.assertEqual(decision.strategy, 'unindexed')
+            decision = planner.plan(field, 'icontains_unaccent_smart', u"otaeku", connection)
+            self.assertEqual(decision.strategy, 'unaccent')
+
+            # Decided when rendering, on the statistics of the connection of the query
+            queryset = Person.objects.filter(name__icontains_unaccent_smart=u"elo")
+            queryset.query.get_compiler(using='default').as_sql()
+            self.assertEqual(find_unaccent_node(queryset.query.where).function, 'unaccent')
+
+
+class UnaccentEvaluatorTestCase(TestCase):
+
+    # Lower case, see test_sql_parity
+    usernames = [u"ôtâèkù", u"otaeku", u"élodie", u"lodève"]
+    terms = [u"otaeku", u"ôtâèkù", u"tâè", u"tae", u"kù", u"lod", u"élodie", u"eve", u"zzz", u"o"]
+    # SQLite only folds the case of ascii characters and its LIKE is case insensitive
+    postgresql_terms = [u"OTAEKU", u"Ôtâ", u"ÉLODIE", u"TAE"]
+
+    def setUp(self):
+        self.users = [User.objects.create(username=username) for username in self.usernames]
+        self.group = Group.objects.create(name=u"Équipe")
+        self.users[0].groups.add(self.group, Group.objects.create(name=u"Other"))
+
+    def assert_same_results(self, lookup_type, term):
+        key = 'username__%s' % lookup_type
+        expected = set(User.objects.filter(**{key: term}).values_list('pk', flat=True))
+        self.assertEqual(set(user.pk for user in unaccent_filter(self.users, **{key: term})), expected,
+                         '%s=%r' % (key, term))
+
+    def test_sql_parity(self):
+        terms = self.terms + (self.postgresql_terms if connection.vendor == 'postgresql' else [])
+        lookup_types = [lookup_type for lookup_type, lookup in UnaccentOperation.lookups.iteritems()
+                        if not lookup.multiple and not lookup.text_search]
+        for lookup_type in lookup_types + list(UnaccentOperation.non_unaccent_filter_fallback.values()):
+            for term in terms:
+                self.assert_same_results(lookup_type, term)
+
+    def test_multiple(self):
+        for lookup_type in ('in_unaccent', 'iin_unaccent', 'in_unaccent_smart', 'iin_unaccent_smart'):
+            for terms in ([u"otaeku", u"élodie"], [u"ÔTÂÈKÙ", u"Lodeve"], [u"zzz"], []):
+                # SQLite's UPPER does not fold the case of the accented terms
+                if connection.vendor == 'sqlite' and lookup_type == 'iin_unaccent_smart' and any(map(has_accents, terms)):
+                    continue
+                self.assert_same_results(lookup_type, terms)
+
+    def test_prefetched(self):
+        user = User.objects.prefetch_related('groups').get(pk=self.users[0].pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(unaccent_filter(user.groups.all(), name__iunaccent=u"equipe"), [self.group])
+            self.assertEqual(unaccent_filter(user.groups.all(), name__iunaccent_smart=u"equipe"), [self.group])
+            self.assertEqual(unaccent_filter(user.groups.all(), name__iunaccent_smart=u"Equipé"), [])
+
+    def test_dicts(self):
+        rows = [{'name': u"São Paulo", 'country': {'code': u"BR"}}, {'name': u"Sao Tome", 'country': None},
+                {'name': None, 'country': {'code': u"BR"}}]
+        self.assertEqual(unaccent_filter(rows, name__istartswith_unaccent=u"sao"), rows[:2])
+        self.assertEqual(unaccent_filter(rows, name__istartswith_unaccent=u"sao", country__code__iexact=u"br"),
+                         rows[:1])
+        self.assertEqual(unaccent_filter(rows, name__icontains_unaccent_smart=u"sã"), rows[:1])
+        # Keys without a lookup_type are exact lookups
+        self.assertEqual(unaccent_filter(rows, country__code=u"BR"), [rows[0], rows[2]])
+        self.assertEqual(unaccent_filter(rows, name=u"Sao Tome"), rows[1:2])
+        self.assertRaises(ValueError, unaccent_filter, rows, name__regex=u"^Sao")
+        # None terms are handled as by QuerySet.filter
+        self.assertEqual(unaccent_filter(rows, country=None), rows[1:2])
+        self.assertEqual(unaccent_filter(rows, name__exact=None), rows[2:])
+        self.assertRaises(ValueError, unaccent_filter, rows, name__iunaccent=None)
+
+    def test_compile_lookup(self):
+        matches = compile_lookup('iendswith_unaccent', u"PAULÔ")
+        self.assertTrue(matches(u"São Paulo"))
+        self.assertFalse(matches(None))
+        self.assertTrue(compile_lookup('unaccent', u"12")(12))
+        self.assertRaises(ValueError, compile_lookup, 'search_unaccent', u"paulo")
+        self.assertRaises(ValueError, compile_lookup, 'regex', u"paulo")
+
+
+class UnaccentKeysetIteratorTestCase(TestCase):
+
+    def setUp(self):
+        # Duplicated normalized values, so that the primary key is needed to resume the iteration
+        names = [u"Élodie", u"elodie", u"Ôtâèkù", u"otaeku", u"Lodève", u"zzz"]
+        self.users = [User.objects.create(username=u"%s %d" % (name, i)) for i in range(4) for name in names]
+
+    def expected(self, lookup_type, term):
+        users = User.objects.filter(**{'username__' + lookup_type: term})
+        keys = [(UnaccentOperation.normalize(lookup_type, user.username), user.pk) for user in users]
+        return [pk for key, pk in sorted(keys)]
+
+    def test_chunks(self):
+        expected = self.expected('icontains_unaccent', u"o")
+        self.assertEqual(len(expected), 20)
+        for chunk_size in (1, 3, 20, 100):
+            # One query per chunk, the last one being partial or empty
+            with self.assertNumQueries(len(expected) // chunk_size + 1):
+                users = list(keyset_iterator(User.objects.all(), 'username', 'icontains_unaccent', u"o", chunk_size))
+            self.assertEqual([user.pk for user in users], expected)
+
+    def test_keys(self):
+        users = list(keyset_iterator(User.objects.all(), 'username', 'iunaccent', u"elodie 0", chunk_size=1))
+        self.assertEqual([user.pk for user in users], self.expected('iunaccent', u"elodie 0"))
+        self.assertEqual(set(user.unaccent_key for user in users), set([u"ELODIE 0"]))
+
+        # The order of the keys depends on the collation of the database
+        users = list(keyset_iterator(User.objects.exclude(username__startswith=u"É"), 'username',
+                                     'contains_unaccent_smart', u"od", chunk_size=3))
+        self.assertEqual(len(set(user.pk for user in users)), 8)
+        self.assertEqual(set(user.unaccent_key for user in users),
+                         set([u"elodie %d" % i for i in range(4)] + [u"Lodeve %d" % i for i in range(4)]))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, list, keyset_iterator(User.objects.all(), 'username', 'search_unaccent', u"o"))
+        self.assertRaises(ValueError, list, keyset_iterator(User.objects.all(), 'username', 'iunaccent', u"o", 0))
+
+    def test_keyset_index_sql(self):
+        statements = dict(index_sql(User, User._meta.get_field('username'), connection, keyset=True))
+        for suffix, lookup_type, method, opclass in KEYSET_INDEX_VARIANTS:
+            sql = statements[index_name(User, User._meta.get_field('username'), suffix, connection)]
+            self.assertTrue(sql.endswith(', %s)' % connection.ops.quote_name('id')), sql)
+
 
 def suite():
     s = unittest.TestSuite()
     s.addTest(unittest.makeSuite(UnaccentTestCase))
+    s.addTest(unittest.makeSuite(UnaccentNormalizedTermsTestCase))
+    s.addTest(unittest.makeSuite(UnaccentIndexTestCase))
+    s.addTest(unittest.makeSuite(UnaccentIndexSqlTestCase))
+    s.addTest(unittest.makeSuite(UnaccentTrigramIndexTestCase))
+    s.addTest(unittest.makeSuite(UnaccentCollationTestCase))
+    s.addTest(unittest.makeSuite(UnaccentTextSearchTestCase))
+    s.addTest(unittest.makeSuite(UnaccentCheckIndexesTestCase))
+    s.addTest(unittest.makeSuite(UnaccentConcatFilterTestCase))
+    s.addTest(unittest.makeSuite(UnaccentNodeTestCase))
+    s.addTest(unittest.makeSuite(UnaccentShadowFieldTestCase))
+    s.addTest(unittest.makeSuite(UnaccentPrefixIndexTestCase))
+    s.addTest(unittest.makeSuite(UnaccentResultCacheTestCase))
+    s.addTest(unittest.makeSuite(UnaccentRulesTestCase))
+    s.addTest(unittest.makeSuite(UnaccentMetricsTestCase))
+    s.addTest(unittest.makeSuite(UnaccentPlannerTestCase))
+    s.addTest(unittest.makeSuite(UnaccentEvaluatorTestCase))
+    s.addTest(unittest.makeSuite(UnaccentKeysetIteratorTestCase))
     return s
 
@@ -4,11 +4,20 @@ adding all operators present in the UnaccentOperation class (operators and smart
 """
 
 
+from functools import partial
 from itertools import izip, repeat
+import re
 import unicodedata
 
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
 from django.db.models.sql import Query
-from django.db.models.sql.where import WhereNode
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.db.models.sql.where import AND, WhereNode
+from django.test.signals import setting_changed
+
+from . import rules
 
 original_where_node_add = WhereNode.add
 monkey_patched = False
@@ -29,13 +38,35 @@ def patched_wherenode_add(self, data, connector):
 
     # Mimics WhereNode.add method, introspects the object about to be added to the WhereNode tree,
     # possibly applying relevant modifications which will eventually be passed to the orignal WhereNode.add method
-    if isinstance(data, (list, tuple)):
+    # Other lookup types go straight to the original method.
+    if isinstance(data, (list, tuple)) and data[1] in UnaccentOperation.lookups:
         constraint, lookup_type, value = data
+        if hasattr(value, 'query') or hasattr(value, 'as_sql') or hasattr(value, '_as_sql'):
+            # Subqueries and expressions can not be normalized in Python
+            raise ValueError("The %s lookup does not accept querysets nor expressions, evaluate them first "
+                             "(eg: list(queryset))" % lookup_type)
+        if UnaccentOperation.lookups[lookup_type].multiple:
+            if not hasattr(value, '__iter__'):
+                raise ValueError("The %s lookup expects a list of search terms" % lookup_type)
+            # As WhereNode.add, consume generators so that the node can be rendered again.
+            # A tuple is immutable and can be shared by the copies of the node.
+            # As in SQL, None never matches.
+            value = tuple(term for term in value if term is not None)
 
         # Introspect and shortcut with our special object if that match the UnaccentOperation keys
-        accept, new_lookup_type = UnaccentOperation.accept(lookup_type, value)
+        if UnaccentOperation.planner is not None:
+            # The adaptive planner may also pick the function the column is unaccented with
+            decision = UnaccentOperation.planner.plan(constraint.field, lookup_type, value)
+            accept, new_lookup_type, function = decision.accepted, decision.lookup_type, decision.function
+            adaptive = decision.strategy == 'adaptive'
+        else:
+            accept, new_lookup_type = UnaccentOperation.accept(lookup_type, value)
+            function, adaptive = None, False
         if accept:
-            data = UnaccentNode(constraint.alias, constraint.col, constraint.field, new_lookup_type, value)
+            data = UnaccentNode(constraint.alias, constraint.col, constraint.field, new_lookup_type, value, function,
+                                adaptive)
+            if UnaccentOperation.metrics is not None:
+                UnaccentOperation.metrics.record_lookup(new_lookup_type)
         else:
             data = (constraint, new_lookup_type, value)
 
@@ -50,31 +81,62 @@ def monkey_patch_where_node():
 
     # Update the operators accepted by a query when adding filters by adding those of unaccent
     # This way, it passes the test at db/models/sql/query.py:1021 which otherwise will override our custom lookup_types
-    Query.query_terms.update(izip(UnaccentOperation.operators.keys() + UnaccentOperation.smart_operators, repeat(None)))
+    Query.query_terms.update(izip(UnaccentOperation.lookups, repeat(None)))
     WhereNode.add = patched_wherenode_add
 
+    # Databases without an unaccent function get the Python one
+    connection_created.connect(register_sqlite_functions, dispatch_uid='django_unaccent.register_sqlite_functions')
+    for connection in connections.all():
+        if connection.connection is not None:
+            register_sqlite_functions(connection=connection)
+
+def register_sqlite_functions(sender=None, connection=None, **kwargs):
+    """Registers the Python unaccent engine as the unaccent SQL functions of a SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+    from django.db.backends.sqlite3.base import Database
+
+    for name in ('unaccent', UnaccentOperation.immutable_function):
+        try:
+            # Lets SQLite use the functions in indexes (Python >= 3.8, SQLite >= 3.8.3)
+            connection.connection.create_function(name, 1, rules.unaccent, deterministic=True)
+        except (TypeError, getattr(Database, 'NotSupportedError', TypeError)):
+            connection.connection.create_function(name, 1, rules.unaccent)
+
 
 class UnaccentNode(object):
     """Custom unaccent node object to be inserted in the WhereNode that can render sql by itself.
     """
-    # As Constraint class, it could implement __setstate__ and __getstate__.
+    __slots__ = ('table_alias', 'col_name', 'field', 'lookup_type', 'value', 'function', 'adaptive')
+    # Every attribute, including those of the subclasses, see __deepcopy__
+    attributes = __slots__
 
-    def __init__(self, alias, col, field, lookup_type, value):
+    def __init__(self, alias, col, field, lookup_type, value, function=None, adaptive=False):
+        """
+        Args:
+            function: SQL function unaccenting the column, defaults to UnaccentOperation.get_function()
+            adaptive: whether the function is picked by the adaptive planner when rendering the node,
+                      from the statistics of the database the query runs on (see planner.UnaccentPlanner)
+        """
         self.table_alias = alias
         self.col_name = col
         self.field = field
         self.lookup_type = lookup_type
         self.value = value
+        self.function = function
+        self.adaptive = adaptive
 
-    def sql_for_columns(self, qn, connection):
-        """Taken from WhereNode.sql_for_columns"""
+    def sql_for_columns(self, qn, connection, col_name=None, field=None):
+        """Taken from WhereNode.sql_for_columns, col_name and field default to those of the node"""
+        col_name = col_name or self.col_name
+        field = field or self.field
 
-        db_type = self.field.db_type(connection=connection)
+        db_type = field.db_type(connection=connection)
 
         if self.table_alias:
-            lhs = '%s.%s' % (qn(self.table_alias), qn(self.col_name))
+            lhs = '%s.%s' % (qn(self.table_alias), qn(col_name))
         else:
-            lhs = qn(self.col_name)
+            lhs = qn(col_name)
         return connection.ops.field_cast_sql(db_type) % lhs
 
     def as_sql(self, qn, connection):
@@ -87,29 +149,323 @@ class UnaccentNode(object):
         """
         lookup_type, value = self.lookup_type, self.value
 
-        field_sql_name = self.sql_for_columns(qn, connection)
-        field_sql = UnaccentOperation.lookup_cast(lookup_type) % field_sql_name
+        if self.adaptive and UnaccentOperation.planner is not None:
+            self.function = UnaccentOperation.planner.rendering_function(self, connection)
 
+        # The rendered SQL only depends on the column and the lookup_type: compile it once
+        key = self.cache_key(qn, connection)
+        compiled = UnaccentOperation.sql_cache.get(key)
+        if compiled is None:
+            compiled = UnaccentOperation.cache_sql(key, self.compile(qn, connection))
+        query_part, normalize = compiled
+
+        if UnaccentOperation.metrics is not None:
+            UnaccentOperation.metrics.rendered(lookup_type)
+
+        if UnaccentOperation.lookups[lookup_type].multiple:
+            return self.multiple_as_sql(query_part, normalize, qn, connection)
+
+        if normalize is not None:
+            value = normalize(value)
         search_term = UnaccentOperation.get_db_prep_lookup(connection, lookup_type, value)
 
-        query_part = '%s %s' % (field_sql, UnaccentOperation.operators[lookup_type])
         return query_part, (search_term,)
 
+    def cache_key(self, qn, connection):
+        return (self.table_alias and qn(self.table_alias), self.field.model, self.col_name, self.lookup_type,
+                self.function, connection.vendor)
+
+    def multiple_as_sql(self, field_sql, normalize, qn, connection):
+        """Renders the lookups comparing the column to a list of search terms (eg: in_unaccent).
+
+        The terms are normalized in Python and sent as a single array parameter, whatever their number.
+        Smart lookups compare the accented terms to the column itself, without unaccent.
+        """
+        lookup = UnaccentOperation.lookups[self.lookup_type]
+
+        values, accented_values = set(), set()
+        for value in self.value:
+            if lookup.smart and has_accents(value):
+                accented_values.add(value.upper() if lookup.case_insensitive else value)
+            else:
+                values.add(normalize(value) if normalize is not None else value)
+
+        query_parts, params = [], []
+        if values:
+            query_part, in_params = UnaccentOperation.in_sql(field_sql, values, connection.vendor)
+            query_parts.append(query_part)
+            params.extend(in_params)
+        if accented_values:
+            column = self.sql_for_columns(qn, connection)
+            if lookup.case_insensitive:
+                column = 'UPPER(%s)' % column
+            query_part, in_params = UnaccentOperation.in_sql(column, accented_values, connection.vendor)
+            query_parts.append(query_part)
+            params.extend(in_params)
+
+        if not query_parts:
+            # As Django's 'in' lookup, an empty list matches nothing
+            raise EmptyResultSet
+        if len(query_parts) == 1:
+            return query_parts[0], params
+        return '(%s)' % ' OR '.join(query_parts), params
+
+    def lhs_sql(self, qn, connection, function=None):
+        """Returns the normalized column the search term is compared to: the indexes (see the indexes module)
+        and the orderings (see keyset.keyset_iterator) must be built on this exact expression.
+
+        Args:
+            function: SQL function unaccenting the column, defaults to that of the node
+        """
+        lookup_type, vendor = self.lookup_type, connection.vendor
+
+        shadow = UnaccentOperation.get_shadow_field(self.field, lookup_type)
+        if shadow is not None:
+            # No function is applied to the column so a plain index on the shadow column can be used.
+            return self.sql_for_columns(qn, connection, shadow.column, shadow)
+
+        collation = UnaccentOperation.get_collation(lookup_type, vendor)
+        if collation is not None:
+            # An index built on the column with the same collation can be used.
+            return '%s COLLATE %s' % (self.sql_for_columns(qn, connection), qn(collation))
+
+        function = function or self.function or UnaccentOperation.get_function()
+        return UnaccentOperation.lookup_cast(lookup_type, function, vendor) % self.sql_for_columns(qn, connection)
+
+    def compile(self, qn, connection):
+        """
+        Returns:
+            tuple (query_part, normalize):
+                query_part: string with a place holder for the search term
+                normalize: function normalizing the search term in Python, or None
+        """
+        lookup_type, vendor = self.lookup_type, connection.vendor
+        lookup = UnaccentOperation.lookups[lookup_type]
+        field_sql = self.lhs_sql(qn, connection)
+
+        shadow = UnaccentOperation.get_shadow_field(self.field, lookup_type)
+        if shadow is not None:
+            # Compares the normalized search term to the pre-normalized shadow column.
+            normalize = shadow.normalize
+        elif UnaccentOperation.get_collation(lookup_type, vendor) is not None:
+            # The collation ignores the accents (and the case) of both sides: the search term is sent as is.
+            normalize = None
+        else:
+            # The text search configuration normalizes the search term of the full text lookups itself
+            if not lookup.multiple and (lookup.text_search or not UnaccentOperation.normalize_terms()):
+                function = self.function or UnaccentOperation.get_function()
+                return '%s %s' % (field_sql, UnaccentOperation.operator(lookup_type, function, vendor)), None
+
+            # Search terms normalized in Python are compared as is, without calling unaccent on the server
+            normalize = partial(UnaccentOperation.normalize, lookup_type)
+
+        if lookup.multiple:
+            # Only the column side is compiled, the list of search terms is rendered by multiple_as_sql
+            return field_sql, normalize
+
+        normalized_operator = UnaccentOperation.operator(lookup_type, vendor=vendor,
+                                                         operators=UnaccentOperation.normalized_operators)
+        return '%s %s' % (field_sql, normalized_operator), normalize
+
     def relabel_aliases(self, change_map):
-        if self.alias in change_map:
-            self.alias = change_map[self.alias]
+        if self.table_alias in change_map:
+            self.table_alias = change_map[self.table_alias]
+
+    def __getstate__(self):
+        """As Constraint, stores a reference to the field as it is not necessarily pickleable"""
+        return {
+            'table_alias': self.table_alias,
+            'col_name': self.col_name,
+            'model': self.field.model,
+            'field_name': self.field.name,
+            'lookup_type': self.lookup_type,
+            'value': self.value,
+            'function': self.function,
+            'adaptive': self.adaptive,
+        }
+
+    def __setstate__(self, state):
+        self.table_alias = state['table_alias']
+        self.col_name = state['col_name']
+        self.field = state['model']._meta.get_field(state['field_name'])
+        self.lookup_type = state['lookup_type']
+        self.value = state['value']
+        self.function = state.get('function')
+        self.adaptive = state.get('adaptive', False)
+
+    def __deepcopy__(self, memo):
+        """Called by Query.clone: only the alias (see relabel_aliases) and the function of the adaptive nodes
+        (see as_sql) are ever modified, the other attributes, the field in particular, are shared with the copy.
+        """
+        obj = self.__class__.__new__(self.__class__)
+        for name in self.attributes:
+            setattr(obj, name, getattr(self, name))
+        return obj
+
+
+class UnaccentConcatNode(UnaccentNode):
+    """Applies a lookup to the concatenation of several columns of a table, separated by spaces:
+    a single unaccent() call per row, served by a single expression index (see indexes.concat_index_sql).
+    """
+
+    __slots__ = ('fields',)
+    attributes = UnaccentNode.attributes + __slots__
+
+    def __init__(self, alias, fields, lookup_type, value):
+        super(UnaccentConcatNode, self).__init__(alias, None, fields[0], lookup_type, value)
+        self.fields = tuple(fields)
+
+    def __getstate__(self):
+        state = super(UnaccentConcatNode, self).__getstate__()
+        state['field_names'] = [field.name for field in self.fields]
+        return state
+
+    def __setstate__(self, state):
+        super(UnaccentConcatNode, self).__setstate__(state)
+        self.fields = tuple(self.field.model._meta.get_field(name) for name in state['field_names'])
+
+    def cache_key(self, qn, connection):
+        return (self.table_alias and qn(self.table_alias), self.field.model,
+                tuple(field.column for field in self.fields), self.lookup_type, connection.vendor)
+
+    def lhs_sql(self, qn, connection, function=None):
+        """Returns the normalized concatenation, expression indexes must be created on this exact expression"""
+        function = function or UnaccentOperation.get_function()
+        cast = UnaccentOperation.text_casts.get(connection.vendor, '%s')
+        columns = [cast % self.sql_for_columns(qn, connection, field.column, field) for field in self.fields]
+        concat = " || ' ' || ".join("COALESCE(%s, '')" % column for column in columns)
+        return UnaccentOperation.lookup_cast(self.lookup_type, function, connection.vendor) % ('(%s)' % concat)
+
+    def compile(self, qn, connection):
+        lookup_type, vendor = self.lookup_type, connection.vendor
+        function = UnaccentOperation.get_function()
+        field_sql = self.lhs_sql(qn, connection, function)
+
+        if UnaccentOperation.normalize_terms():
+            normalized_operator = UnaccentOperation.operator(lookup_type, vendor=vendor,
+                                                             operators=UnaccentOperation.normalized_operators)
+            return '%s %s' % (field_sql, normalized_operator), partial(UnaccentOperation.normalize, lookup_type)
+
+        return '%s %s' % (field_sql, UnaccentOperation.operator(lookup_type, function, vendor)), None
+
+
+def concat_filter(queryset, field_names, lookup_type, value):
+    """Returns `queryset' filtered by applying the lookup_type to the concatenation of the fields.
+
+    As the concatenation is normalized once, searching several fields costs a single unaccent() call per row
+    instead of one per field:
+
+    >>> concat_filter(User.objects.all(), ['first_name', 'last_name', 'email'], 'icontains_unaccent', u'jérôme')
+
+    Note that a search term containing spaces may match across two adjacent fields.
+    """
+    lookup = UnaccentOperation.lookups.get(lookup_type)
+    if lookup is None or lookup.smart or lookup.multiple:
+        raise ValueError("%r cannot be applied to a concatenation of fields" % lookup_type)
+
+    queryset = queryset._clone()
+    fields = [queryset.model._meta.get_field(name) for name in field_names]
+    query = queryset.query
+    query.where.add(UnaccentConcatNode(query.get_initial_alias(), fields, lookup_type, value), AND)
+    return queryset
+
+class UnaccentLookup(object):
+    """Everything needed to accept and render a lookup_type, precomputed once (see UnaccentOperation.lookups)"""
+    __slots__ = ('name', 'lookup_type', 'smart', 'fallback', 'case_insensitive', 'like_pattern', 'multiple',
+                 'text_search')
+
+    def __init__(self, name, lookup_type, smart, fallback, case_insensitive, like_pattern, multiple, text_search):
+        self.name = name
+        self.lookup_type = lookup_type
+        self.smart = smart
+        self.fallback = fallback
+        self.case_insensitive = case_insensitive
+        self.like_pattern = like_pattern
+        self.multiple = multiple
+        self.text_search = text_search
+
 
 class UnaccentOperation:
 
+    # '{0}' is replaced by the name of the unaccent SQL function (see get_function)
     operators = {
-        'unaccent': '= unaccent(%s)',
-        'iunaccent': '= UPPER(unaccent(%s))',
-        'contains_unaccent': "LIKE unaccent(%s)",
-        'icontains_unaccent': "LIKE UPPER(unaccent(%s))",
-        'startswith_unaccent': "LIKE unaccent(%s)",
-        'istartswith_unaccent': "LIKE UPPER(unaccent(%s))",
-        'endswith_unaccent': "LIKE unaccent(%s)",
-        'iendswith_unaccent': "LIKE UPPER(unaccent(%s))",
+        'unaccent': '= {0}(%s)',
+        'iunaccent': '= UPPER({0}(%s))',
+        'contains_unaccent': "LIKE {0}(%s)",
+        'icontains_unaccent': "LIKE UPPER({0}(%s))",
+        'startswith_unaccent': "LIKE {0}(%s)",
+        'istartswith_unaccent': "LIKE UPPER({0}(%s))",
+        'endswith_unaccent': "LIKE {0}(%s)",
+        'iendswith_unaccent': "LIKE UPPER({0}(%s))",
+        # The search term is a list of terms normalized in Python, see UnaccentNode.multiple_as_sql
+        'in_unaccent': "= ANY(%s)",
+        'iin_unaccent': "= ANY(%s)",
+        # '{config}' is replaced by the text search configuration (see get_text_search_config)
+        'search_unaccent': "@@ plainto_tsquery('{config}', %s)",
+    }
+
+    # Used when both the column and the search term are already normalized (eg: shadow columns)
+    normalized_operators = {
+        'unaccent': '= %s',
+        'iunaccent': '= %s',
+        'contains_unaccent': "LIKE %s",
+        'icontains_unaccent': "LIKE %s",
+        'startswith_unaccent': "LIKE %s",
+        'istartswith_unaccent': "LIKE %s",
+        'endswith_unaccent': "LIKE %s",
+        'iendswith_unaccent': "LIKE %s",
+        'in_unaccent': "= ANY(%s)",
+        'iin_unaccent': "= ANY(%s)",
+        'search_unaccent': "@@ plainto_tsquery('{config}', %s)",
+    }
+
+    # Cast of the column to text, per database vendor
+    text_casts = {
+        'postgresql': '%s::text',
+    }
+
+    # Appended to LIKE comparisons: prep_for_like_query escapes with '\\', which is not a default on every database
+    like_escapes = {
+        'sqlite': " ESCAPE '\\'",
+    }
+
+    case_insensitive_operators = ('iunaccent', 'icontains_unaccent', 'istartswith_unaccent', 'iendswith_unaccent',
+                                  'iin_unaccent')
+
+    # lookup_type -> nondeterministic ICU collation comparing strings as the lookup does (PostgreSQL >= 12),
+    # used in place of the unaccent function when UNACCENT_USE_COLLATIONS is True, see get_collation.
+    # LIKE can not be used with these collations: the other lookups keep the function form.
+    collations = {
+        'unaccent': 'django_unaccent',
+        'iunaccent': 'django_iunaccent',
+        'in_unaccent': 'django_unaccent',
+        'iin_unaccent': 'django_iunaccent',
+    }
+
+    # ICU locale of the collations: primary strength ignores accents and case, caseLevel restores the case
+    collation_locales = {
+        'django_unaccent': 'und-u-ks-level1-kc-true',
+        'django_iunaccent': 'und-u-ks-level1',
+    }
+
+    # Operators whose search term is a list of terms
+    multiple_operators = ('in_unaccent', 'iin_unaccent')
+
+    # Full text operators: the text search configuration unaccents both the column and the search term
+    # (PostgreSQL only, see the unaccent_text_search command)
+    text_search_operators = ('search_unaccent',)
+    text_search_config = 'unaccent_cfg'
+    # Used by the smart operators when accents are found in the search term, the accents are then significant
+    text_search_fallback_config = 'simple'
+
+    # Formats the search term, escaped by prep_for_like_query, of LIKE queries
+    like_patterns = {
+        'contains_unaccent': u"%{0}%",
+        'icontains_unaccent': u"%{0}%",
+        'startswith_unaccent': u"{0}%",
+        'istartswith_unaccent': u"{0}%",
+        'endswith_unaccent': u"%{0}",
+        'iendswith_unaccent': u"%{0}",
     }
 
     # Add smart operators, whose name are suffixed by _smart
@@ -125,8 +481,116 @@ class UnaccentOperation:
         'istartswith_unaccent': 'istartswith',
         'endswith_unaccent': 'endswith',
         'iendswith_unaccent': 'iendswith',
+        # Smart multiple operators do not fall back as a whole, see UnaccentNode.multiple_as_sql
     }
 
+    # Name of the IMMUTABLE wrapper around unaccent() created by the unaccent_indexes command
+    immutable_function = 'f_unaccent'
+
+    # (model, source field name, upper) -> UnaccentShadowField, see register_shadow_field
+    shadow_fields = {}
+
+    # Every accepted lookup_type, smart ones included -> UnaccentLookup, see build_lookups
+    lookups = {}
+
+    # (quoted alias, model, column, lookup_type, function, vendor) -> (query_part, normalize), see UnaccentNode.as_sql
+    sql_cache = {}
+    sql_cache_size = 1024
+
+    # metrics.UnaccentMetrics instance once the instrumentation is enabled, see metrics.enable_instrumentation
+    metrics = None
+
+    # planner.UnaccentPlanner instance once the adaptive smart mode is enabled, see planner.enable_adaptive_planner
+    planner = None
+
+    @classmethod
+    def build_lookups(cls):
+        """Precomputes the lookups table from the operators, must be called when they are modified"""
+        lookups = {}
+        for lookup_type in cls.operators:
+            for name, smart in ((lookup_type, False), (lookup_type + '_smart', True)):
+                lookups[name] = UnaccentLookup(name, lookup_type, smart,
+                                               cls.non_unaccent_filter_fallback.get(lookup_type),
+                                               lookup_type in cls.case_insensitive_operators,
+                                               cls.like_patterns.get(lookup_type),
+                                               lookup_type in cls.multiple_operators,
+                                               lookup_type in cls.text_search_operators)
+        cls.lookups = lookups
+        cls.smart_operators = [name for name, lookup in lookups.iteritems() if lookup.smart]
+        cls.clear_sql_cache()
+
+    @classmethod
+    def cache_sql(cls, key, compiled):
+        if len(cls.sql_cache) >= cls.sql_cache_size:
+            cls.sql_cache.clear()
+        cls.sql_cache[key] = compiled
+        return compiled
+
+    @classmethod
+    def clear_sql_cache(cls, **kwargs):
+        cls.sql_cache.clear()
+
+    @classmethod
+    def register_shadow_field(cls, model, source, upper, shadow):
+        cls.shadow_fields[(model, source, upper)] = shadow
+        cls.clear_sql_cache()
+
+    @classmethod
+    def get_shadow_field(cls, field, lookup_type):
+        """Returns the shadow field holding the normalized values of `field' suitable for lookup_type, or None"""
+        if not cls.shadow_fields or cls.lookups[lookup_type].text_search:
+            return None
+        upper = cls.lookups[lookup_type].case_insensitive
+        return cls.shadow_fields.get((field.model, field.name, upper))
+
+    @classmethod
+    def get_function(cls):
+        """Returns the name of the SQL function used to unaccent both the column and the search term.
+
+        Defaults to 'unaccent'. Set UNACCENT_FUNCTION to cls.immutable_function ('f_unaccent')
+        once the wrapper exists so that expression indexes can serve the lookups.
+        """
+        return getattr(settings, 'UNACCENT_FUNCTION', 'unaccent')
+
+    @classmethod
+    def get_collation(cls, lookup_type, vendor):
+        """Returns the name of the collation serving lookup_type, or None if the unaccent function is used.
+
+        Set UNACCENT_USE_COLLATIONS to True once the collations exist (see the unaccent_collations command).
+        """
+        if vendor != 'postgresql' or not getattr(settings, 'UNACCENT_USE_COLLATIONS', False):
+            return None
+        return cls.collations.get(cls.lookups[lookup_type].lookup_type)
+
+    @classmethod
+    def get_text_search_config(cls, lookup_type):
+        """Returns the text search configuration of a full text lookup_type.
+
+        Defaults to 'unaccent_cfg', created by the unaccent_text_search command, set UNACCENT_TEXT_SEARCH_CONFIG
+        to use another one. The smart lookup_types are only kept by accept when accents were found in the search
+        term: they use a configuration which does not unaccent.
+        """
+        if cls.lookups[lookup_type].smart:
+            return cls.text_search_fallback_config
+        return getattr(settings, 'UNACCENT_TEXT_SEARCH_CONFIG', cls.text_search_config)
+
+    @classmethod
+    def normalize_terms(cls):
+        """Whether search terms are normalized in Python (see normalize) rather than by the database.
+
+        Set UNACCENT_NORMALIZE_TERMS to True to send plain parameters (eg: `= %s') to the database,
+        the Python engine must then follow the rules of the database (see rules.get_rules_file).
+        """
+        return getattr(settings, 'UNACCENT_NORMALIZE_TERMS', False)
+
+    @classmethod
+    def normalize(cls, lookup_type, value):
+        """Python counterpart of the database side normalization of the search term"""
+        value = rules.unaccent(value)
+        if cls.lookups[lookup_type].case_insensitive:
+            value = value.upper()
+        return value
+
     @classmethod
     def accept(cls, lookup_type, search_term):
         """
@@ -137,18 +601,29 @@ class UnaccentOperation:
                                 removes the '_smart' suffix or returns an equivalent 'non-unaccent' lookup_type
         """
 
-        if lookup_type not in UnaccentOperation.operators and lookup_type not in UnaccentOperation.smart_operators:
+        lookup = cls.lookups.get(lookup_type)
+        if lookup is None:
             return False, lookup_type
 
-        if lookup_type.endswith('_smart'):
-            lookup_type = lookup_type[:-len('_smart')]
+        if lookup.multiple:
+            # The accented terms are picked out of the list when rendering, the smart lookup_type is kept
+            return True, lookup.name
+
+        if lookup.text_search and lookup.smart and has_accents(search_term):
+            # There is no full text lookup in Django to fall back to: the smart lookup_type is kept
+            # and rendered with a configuration which does not unaccent (see get_text_search_config)
+            if cls.metrics is not None:
+                cls.metrics.record_fallback(lookup_type, lookup.name)
+            return True, lookup.name
 
-            if asciify(search_term) != search_term:
-                # Some non-ascii char are used (accents), act as we were specifically looking for them
-                # Don't unaccent and fallback to use an equivalent 'non-unaccen' lookup_type
-                return False, cls.non_unaccent_filter_fallback[lookup_type]
+        if lookup.smart and has_accents(search_term):
+            # Some non-ascii char are used (accents), act as we were specifically looking for them
+            # Don't unaccent and fallback to use an equivalent 'non-unaccen' lookup_type
+            if cls.metrics is not None:
+                cls.metrics.record_fallback(lookup_type, lookup.fallback)
+            return False, lookup.fallback
 
-        return True, lookup_type
+        return True, lookup.lookup_type
 
     @classmethod
     def get_db_prep_lookup(cls, connection, lookup_type, value):
@@ -156,37 +631,105 @@ class UnaccentOperation:
         Returns:
             value: string, given the lookup_type, the identical value or a value processed for an incoming LIKE query
         """
-        if lookup_type in ('contains_unaccent', 'icontains_unaccent'):
-            return u"%{0}%".format(connection.ops.prep_for_like_query(value))
+        like_pattern = cls.lookups[lookup_type].like_pattern
+        if like_pattern is not None:
+            return like_pattern.format(connection.ops.prep_for_like_query(value))
 
-        if lookup_type in ('startswith_unaccent', 'istartswith_unaccent'):
-            return u"{0}%".format(connection.ops.prep_for_like_query(value))
+        return value
 
-        if lookup_type in ('endswith_unaccent', 'iendswith_unaccent'):
-            return u"%{0}".format(connection.ops.prep_for_like_query(value))
+    @classmethod
+    def in_sql(cls, lhs, values, vendor):
+        """Compares lhs to a list of values, sent as a single array parameter if the database supports it"""
+        if vendor == 'postgresql':
+            return '%s = ANY(%%s)' % lhs, [list(values)]
+        return '%s IN (%s)' % (lhs, ', '.join(['%s'] * len(values))), list(values)
 
-        return value
+    @classmethod
+    def operator(cls, lookup_type, function='unaccent', vendor='postgresql', operators=None):
+        """Build the right part of the query (the one related to the search term)"""
+        lookup = cls.lookups[lookup_type]
+        operator = (operators or cls.operators)[lookup.lookup_type]
+        if lookup.text_search:
+            operator = operator.format(function, config=cls.get_text_search_config(lookup_type))
+        else:
+            operator = operator.format(function)
+        if operator.startswith('LIKE'):
+            operator += cls.like_escapes.get(vendor, '')
+        return operator
 
     @classmethod
-    def lookup_cast(cls, lookup_type):
-        """Build the left part of the query (the one related to the column)"""
-        lookup = 'unaccent(%s::text)'
+    def lookup_cast(cls, lookup_type, function='unaccent', vendor='postgresql'):
+        """Build the left part of the query (the one related to the column).
+
+        Expression indexes must be created on this exact expression to be used by the planner.
+        """
+        if cls.lookups[lookup_type].text_search:
+            config = cls.get_text_search_config(lookup_type)
+            return "to_tsvector('%s', %s)" % (config, cls.text_casts.get(vendor, '%s'))
+
+        lookup = '%s(%s)' % (function, cls.text_casts.get(vendor, '%s'))
 
         # Use UPPER(x) for case-insensitive lookups; it's faster.
-        if lookup_type in ('iunaccent', 'icontains_unaccent', 'istartswith_unaccent', 'iendswith_unaccent'):
+        if cls.lookups[lookup_type].case_insensitive:
             lookup = 'UPPER(%s)' % lookup
 
         return lookup
 
 
+UnaccentOperation.build_lookups()
+
+# Rendered SQL depends on the UNACCENT_* settings
+setting_changed.connect(UnaccentOperation.clear_sql_cache, dispatch_uid='django_unaccent.clear_sql_cache')
+
+
 def asciify(unistr):
-    """Returns an ascii string converting accented chars to normal ones.
+    """Returns an ascii string converting accented chars to normal ones, following the unaccent rules
+    (see rules.unaccent) so that the result matches the one of the database.
     Unconvertible chars are just removed.
 
     Thanks at the Autolib' team for providing me this nice little helper!
 
+    Other values are converted to unicode first (eg: asciify(12) == '12'), None is kept as rules.unaccent does.
+
     >>> asciify(u'Ééüçñøà')
-        Eeucna
+        Eeucnoa
+    """
+    if unistr is None:
+        return None
+    if isinstance(unistr, basestring) and not has_accents(unistr):
+        # Nothing to normalize in an ascii string
+        return unistr.encode('ascii')
+    return unicodedata.normalize('NFKD', rules.unaccent(unistr)).encode('ascii', 'ignore')
+
+
+# Any non ascii char: asciify removes or converts all of them
+non_ascii_re = re.compile(u'[^\x00-\x7f]')
+
+
+def has_accents(value):
+    """Whether asciify modifies value, the test of the smart lookups.
+
+    Strings are only searched for a non ascii char, the search stops on the first one.
     """
-    return unicodedata.normalize('NFKD', unicode(unistr)).encode('ascii', 'ignore')
+    if value is None:
+        return False
+    if isinstance(value, basestring) and rules.get_translation_table().ascii_identity:
+        return non_ascii_re.search(value) is not None
+    return unicodedata.normalize('NFKD', rules.unaccent(value)).encode('ascii', 'ignore') != value
 
+
+def asciify_many(values, cache_size=100000):
+    """Returns an iterator over the asciified values, eg: to normalize the values of a bulk_create.
+
+    The values are memoized (up to cache_size distinct values) as imported data usually repeats them
+    (cities, first names...). None values are kept.
+    """
+    memo = {None: None}
+    for value in values:
+        try:
+            yield memo[value]
+        except KeyError:
+            if len(memo) >= cache_size:
+                memo = {None: None}
+            memo[value] = normalized = asciify(value)
+            yield normalized